@@ -0,0 +1,14 @@
+# Gunicorn configuration (see the Procfile)
+from src.context import export_shared_data
+from src.export import prebuild
+
+
+def on_starting(server):
+    '''
+    Load the data once in the master process, before the workers are
+    started, and export it for the workers to attach to
+    (see `export_shared_data` in `/src/context.py`), and prebuild the
+    default figures embedded in the tabs (see `prebuild` in `/src/export.py`).
+    '''
+    export_shared_data()
+    prebuild()
@@ -1,9 +1,12 @@
+import os
+
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
 from app import app
 from tabs import general, matrix, powerCapture, constructiveInterference
+from src.export import prebuild
 import src.colors as colors
 
 # Suppress errors from callback IDs not found
@@ -108,19 +111,31 @@ app.layout = html.Div([
 
 ])
 
+# Tab layouts, built (with the data they need) on the first visit of each
+# tab only. The callbacks of all tabs are registered when importing the
+# tabs modules, such that the browser knows them when loading the app.
+tab_layouts = {
+    'tab-general': general.get_layout,
+    'tab-capture': powerCapture.get_layout,
+    'tab-CI': constructiveInterference.get_layout,
+    'tab-matrix': matrix.get_layout,
+}
+__layouts__ = {}
+
 @app.callback(Output('tabs-example-content', 'children'),
               [Input('tabs-example', 'value')])
 def render_content(tab):
-    if tab == 'tab-general':
-        return general.layout
-    elif tab == 'tab-capture':
-        return powerCapture.layout
-    elif tab == 'tab-CI':
-        return constructiveInterference.layout
-    elif tab == 'tab-matrix':
-        return matrix.layout
+    if tab not in tab_layouts:
+        return
+    if tab not in __layouts__:
+        __layouts__[tab] = tab_layouts[tab]()
+    return __layouts__[tab]
 
 if __name__ == '__main__':
+    # Default figures embedded in the tabs; only in the main process,
+    # not again in the process started by the reloader (debug mode)
+    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        prebuild()
     app.run_server(
         debug=True,
         )
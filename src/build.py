@@ -0,0 +1,221 @@
+'''
+Build pipeline of the derived data, to be run from the repository root:
+
+    python -m src.build [--jobs N] [--force] [--dry-run] [stage ...]
+
+The stages are run in order:
++ clean: raw files of `data_raw_origin` -> `data_raw` (see `clean_raw_data`)
++ parse: per-run files of `data_preprocessed` (see `parse_all_data`)
++ aggregate: `data_preprocessed_all.csv` and `.npz`
++ traces: traces csv files, one target per (pair, payload, axis)
+
+Each target is rebuilt only if the fingerprint of its inputs changed
+since its last build, or if one of its outputs is missing or modified;
+the fingerprints are saved in `data_preprocessed/build.json`.
+Stale targets of the same stage are independent and built in parallel.
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import hashlib
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from src.helpers import inputs_fingerprint, output_record, is_stale, read_state, write_state
+from src.preprocess import (
+    list_runs,
+    parse_all_data,
+    load_preprocessed_data,
+    save_traces,
+    trace_file_name,
+    trace_PowerDelta_values,
+    prr_file,
+    rssi_file,
+    all_csv_file,
+    all_snapshot_file,
+    __clean_run__,
+    __parse_run__,
+    __trace_stats__,
+    __build_traces__,
+)
+
+origin_path = Path('data_raw_origin')
+raw_path = Path('data_raw')
+output_path = Path('data_preprocessed')
+build_file = 'build.json'
+
+stages = ['clean', 'parse', 'aggregate', 'traces']
+
+
+def __clean_targets__():
+    if not origin_path.is_dir():
+        return []
+    return [
+        dict(
+            name='clean/' + '/'.join(run),
+            inputs=[origin_path.joinpath(*run) / f for f in [prr_file, rssi_file]],
+            outputs=[raw_path.joinpath(*run) / f for f in [prr_file, rssi_file]],
+            action=partial(__clean_run__, run),
+        )
+        for run in list_runs(origin_path)
+    ]
+
+def __parse_targets__():
+    return [
+        dict(
+            name='parse/' + '/'.join(run),
+            inputs=[raw_path.joinpath(*run) / f for f in [prr_file, rssi_file]],
+            outputs=[output_path.joinpath(*run) / f for f in ['medianRSSI.csv', prr_file]],
+            action=partial(__parse_run__, run, force_computation='rssi'),
+        )
+        for run in list_runs(raw_path)
+    ]
+
+def __aggregate_targets__():
+    return [
+        dict(
+            name='aggregate',
+            inputs=[output_path.joinpath(*run) / prr_file for run in list_runs(raw_path)],
+            outputs=[output_path / all_csv_file, output_path / all_snapshot_file],
+            action=partial(parse_all_data, force_computation='aggregate'),
+        )
+    ]
+
+def __trace_targets__():
+    df = load_preprocessed_data(output_path)
+    if df is None:
+        return []
+    PowerDeltaValues = sorted(df['PowerDelta'].dropna().unique())
+    TimeDeltaValues = sorted(df['TimeDelta'].dropna().unique())
+
+    targets = []
+    for TransPair in sorted(df['TransPair'].unique()) + ['all']:
+        for SamePayload in sorted(df['SamePayload'].unique()):
+            # Data the traces of the pair and payload are computed from
+            subset = df[df['SamePayload'] == SamePayload]
+            if TransPair != 'all':
+                subset = subset[subset['TransPair'] == TransPair]
+            data = pd.util.hash_pandas_object(
+                subset[['Mode','PowerDelta','TimeDelta','PRR']], index=False)
+
+            for axis, slice_values, x_values in [
+                ('TimeDelta', PowerDeltaValues, TimeDeltaValues),
+                ('PowerDelta', TimeDeltaValues, trace_PowerDelta_values)]:
+                cells = [(TransPair, SamePayload, Delta) for Delta in slice_values]
+                # The time delta traces span all time delta values
+                salt = str(TimeDeltaValues) if axis == 'TimeDelta' else ''
+                targets.append(dict(
+                    name='traces/%s/%s/%s' % (TransPair, SamePayload, axis),
+                    inputs=[],
+                    salt=hashlib.sha1(data.values.tobytes()).hexdigest() + salt,
+                    outputs=[
+                        output_path / trace_file_name(TransPair, SamePayload, axis, Delta)
+                        for _, _, Delta in cells],
+                    action=partial(__compute_traces__, TransPair, SamePayload, axis, x_values, cells),
+                ))
+    return targets
+
+def __compute_traces__(TransPair, SamePayload, axis, x_values, cells):
+    '''
+    Compute the traces of one (pair, payload, axis) target, from the
+    runs of the pair and payload only.
+    '''
+    df = load_preprocessed_data(output_path)
+    df = df[df['SamePayload'] == SamePayload]
+    if TransPair != 'all':
+        df = df[df['TransPair'] == TransPair]
+    slice_name = 'PowerDelta' if axis == 'TimeDelta' else 'TimeDelta'
+    save_traces(
+        __build_traces__(__trace_stats__(df), axis, slice_name, x_values, cells),
+        output_path)
+
+__stage_targets__ = dict(
+    clean=__clean_targets__,
+    parse=__parse_targets__,
+    aggregate=__aggregate_targets__,
+    traces=__trace_targets__,
+)
+
+def __run_target__(action):
+    '''
+    Run the action of a target; returns its duration.
+    '''
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+def build(selected=None, n_jobs=1, force=False, dry_run=False):
+    '''
+    Rebuild the stale targets of the `selected` stages (all by default),
+    in parallel using `n_jobs` processes (n_jobs=None uses all the
+    available cores). Pass `force=True` to rebuild all targets.
+
+    Returns a DataFrame with, per stage, the number of targets,
+    of rebuilt targets, and the time spent.
+    '''
+    state_path = output_path / build_file
+    state = read_state(state_path, 'targets')
+    cache = state['files']
+
+    summary = []
+    for stage in stages:
+        if selected and stage not in selected:
+            continue
+        start = time.perf_counter()
+        targets = __stage_targets__[stage]()
+        fingerprints = [
+            inputs_fingerprint(target['inputs'], cache, target.get('salt', ''))
+            for target in targets]
+        stale = [
+            (target, fingerprint)
+            for target, fingerprint in zip(targets, fingerprints)
+            if force or is_stale(
+                fingerprint, state['targets'].get(target['name']), target['outputs'], cache)
+        ]
+        print('[%s] %i target(s), %i to rebuild' % (stage, len(targets), len(stale)))
+        if dry_run:
+            for target, _ in stale:
+                print('\t%s' % target['name'])
+            summary.append((stage, len(targets), len(stale), 0.0))
+            continue
+
+        actions = [target['action'] for target, _ in stale]
+        if n_jobs == 1 or len(actions) <= 1:
+            durations = [__run_target__(action) for action in actions]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                durations = list(executor.map(__run_target__, actions))
+
+        # Record the state of the rebuilt targets
+        for target, fingerprint in stale:
+            state['targets'][target['name']] = output_record(
+                fingerprint, target['outputs'], cache)
+        write_state(state_path, state)
+
+        summary.append((stage, len(targets), len(stale), time.perf_counter() - start))
+
+    summary = pd.DataFrame(
+        summary, columns=['Stage', 'Targets', 'Rebuilt', 'Time [s]']
+        ).set_index('Stage')
+    print()
+    print(summary.to_string(float_format='%.2f'))
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Rebuild the stale derived data.')
+    parser.add_argument('stages', nargs='*',
+        help='stages to run, among %s (default: all)' % ', '.join(stages))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of parallel processes (0: all cores)')
+    parser.add_argument('-f', '--force', action='store_true',
+        help='rebuild all targets')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+        help='only list the stale targets')
+    args = parser.parse_args()
+    for stage in args.stages:
+        if stage not in stages:
+            parser.error('unknown stage: %s' % stage)
+    build(args.stages, args.jobs or None, args.force, args.dry_run)
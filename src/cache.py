@@ -0,0 +1,162 @@
+import functools
+import inspect
+import json
+import threading
+import warnings
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+
+from src.helpers import Modes
+from src.cube import get_cube
+
+# Maximum (estimated) size of the figures in the cache, in bytes
+figure_cache_bytes = 128 * 2**20
+
+# Cached figures (as dicts), least recently used first, by normalized
+# parameters; each entry is (cube, order of the modes, figure, size)
+__figures__ = OrderedDict()
+__stats__ = dict(hits=0, misses=0, evictions=0, bytes=0)
+__lock__ = threading.Lock()
+
+
+def cached_figure(function):
+    '''
+    Memoize a plotting function `function(df, ...)` returning a figure
+    (as a dict, see `new_figure` in src/plots.py).
+
+    The memoized function returns a `go.Figure`, or with `as_dict=True`
+    the figure dict, which is faster (no validation by plotly) and
+    meant for the Dash callbacks.
+
+    The figures are cached by the normalized parameters of the call
+    (the data, the modes in the order of `Modes`, and the other
+    parameters) and evicted least recently used first once the cache
+    exceeds `figure_cache_bytes`. The figures are always rendered with
+    the modes in the order of the caller: a cached figure whose modes
+    are in another order is rendered again (and replaced).
+
+    The `DataPath` parameter of the plotting functions is deprecated:
+    the figures are built from the data cube, so it is ignored.
+
+    Each call returns a new copy of the figure, which the caller is free
+    to modify (e.g., with `update_layout`).
+    '''
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, as_dict=False, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+
+        if arguments.pop('DataPath', None) is not None:
+            warnings.warn('%s: DataPath is deprecated and ignored' % function.__name__,
+                          DeprecationWarning, stacklevel=2)
+
+        # Normalize the parameters
+        cube = get_cube(arguments['df'])
+        arguments['df'] = cube
+        normalized = dict(arguments)
+        if 'ModesToShow' in arguments:
+            normalized['ModesToShow'] = [
+                mode for mode in Modes if mode in arguments['ModesToShow']]
+        key = (function.__name__, id(cube)) + tuple(
+            (name, __freeze__(value)) for name, value in normalized.items()
+            if name != 'df')
+        order = __freeze__(arguments.get('ModesToShow'))
+
+        with __lock__:
+            entry = __figures__.get(key)
+            if entry is not None and entry[0] is cube and entry[1] == order:
+                __figures__.move_to_end(key)
+                __stats__['hits'] += 1
+            else:
+                entry = None
+                __stats__['misses'] += 1
+
+        if entry is None:
+            figure = function(**arguments)
+            if figure is None:
+                return None
+            entry = (cube, order, figure, __size__(figure))
+            __store__(key, entry)
+
+        # Hand out a copy
+        figure = __copy__(entry[2])
+        if as_dict:
+            return figure
+        return go.Figure(figure)
+
+    wrapper.__signature__ = signature.replace(parameters=list(
+        signature.parameters.values()) + [inspect.Parameter(
+        'as_dict', inspect.Parameter.KEYWORD_ONLY, default=False)])
+    return wrapper
+
+def figure_cache_info():
+    '''
+    Return the statistics of the figure cache: number of hits, misses,
+    and evictions, number of figures and their estimated size in bytes.
+    '''
+    with __lock__:
+        return dict(__stats__, figures=len(__figures__), max_bytes=figure_cache_bytes)
+
+def clear_figure_cache():
+    '''
+    Empty the figure cache and reset its statistics.
+    '''
+    with __lock__:
+        __figures__.clear()
+        __stats__.update(hits=0, misses=0, evictions=0, bytes=0)
+
+def __store__(key, entry):
+    with __lock__:
+        previous = __figures__.pop(key, None)
+        if previous is not None:
+            __stats__['bytes'] -= previous[-1]
+        if entry[-1] > figure_cache_bytes:
+            return
+        __figures__[key] = entry
+        __stats__['bytes'] += entry[-1]
+        while __stats__['bytes'] > figure_cache_bytes:
+            _, evicted = __figures__.popitem(last=False)
+            __stats__['bytes'] -= evicted[-1]
+            __stats__['evictions'] += 1
+
+def __copy__(value):
+    '''
+    Deep copy of a figure dict (faster than `copy.deepcopy`, as
+    lists of numbers are copied at once).
+    '''
+    if isinstance(value, dict):
+        return {k: __copy__(v) for k, v in value.items()}
+    if isinstance(value, list):
+        if len(value) and isinstance(value[0], (dict, list)):
+            return [__copy__(v) for v in value]
+        return list(value)
+    return value
+
+def __freeze__(value):
+    '''
+    Hashable version of a parameter value.
+    '''
+    if isinstance(value, (list, tuple)):
+        return tuple(__freeze__(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+def __size__(value):
+    '''
+    Estimated memory size of a figure dict, in bytes
+    (numbers count for a list slot and a float object).
+    '''
+    if isinstance(value, dict):
+        return sum(__size__(k) + __size__(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        if len(value) and isinstance(value[0], (dict, list, tuple, str)):
+            return sum(__size__(v) for v in value)
+        return 32 * len(value) + 56
+    if isinstance(value, str):
+        return len(value) + 49
+    return 32
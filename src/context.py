@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+from src.preprocess import parse_all_data
+from src.cube import get_cube
+
+# Path to the preprocessed data
+DataPath = Path('data_preprocessed')
+
+# Environment variable giving the path of the data shared between
+# processes (see `export_shared_data`)
+shared_data_env = 'ST_SHARED_DATA'
+shared_meta_file = 'meta.json'
+
+# Data shared by all the tabs, loaded on first use (see `__load__`)
+__context__ = {}
+__lock__ = threading.Lock()
+
+
+def get_data():
+    '''
+    Return the preprocessed data (see `parse_all_data`), shared by all
+    the tabs of the application. The DataFrame must not be modified.
+
+    With shared data (see `export_shared_data`), the DataFrame is
+    assembled from the shared columns on the first call, as a private
+    copy of the process: only the cube (`get_data_cube`), which the
+    application uses, is shared between the processes.
+    '''
+    context = __load__()
+    if 'df' not in context:
+        with __lock__:
+            if 'df' not in context:
+                context['df'] = __frame__(context['columns'], context['meta'])
+    return context['df']
+
+def get_TimeDeltaValues():
+    '''
+    Return the sorted tuple of the time delta values in the data.
+    '''
+    return __load__()['TimeDeltaValues']
+
+def get_data_cube():
+    '''
+    Return the PRR cube of the data (see `build_cube`), which the plotting
+    functions accept in place of the DataFrame.
+    '''
+    return __load__()['cube']
+
+def export_shared_data(path=DataPath / 'shared'):
+    '''
+    Save the columns of the preprocessed data and its PRR cube as .npy
+    files in `path`, and point the processes started afterwards to them
+    (through the `shared_data_env` environment variable).
+
+    These processes (e.g., the gunicorn workers, see `gunicorn.conf.py`)
+    then attach to the files as read-only memory maps instead of loading
+    the data: the operating system holds a single copy in memory,
+    whatever the number of processes (see `src/memcheck.py` to check it).
+
+    Returns the path to the shared data.
+    '''
+    df = parse_all_data()
+    cube = get_cube(df)
+
+    arrays = {'index': df.index.values}
+    meta = {'index': df.index.name, 'columns': list(df.columns), 'categories': {}}
+    for column in df.columns:
+        values = df[column]
+        if hasattr(values, 'cat'):
+            # Categories are stored as integer codes
+            meta['categories'][column] = values.cat.categories.tolist()
+            values = values.cat.codes
+        arrays['df_' + column] = values.values
+    for name, array in cube.items():
+        if isinstance(array, np.ndarray):
+            arrays['cube_' + name] = array
+    for axis, array in cube['axes'].items():
+        # Object arrays cannot be memory mapped
+        arrays['axis_' + axis] = array.astype(str) if array.dtype == object else array
+
+    # Write in a temporary directory first, such that the shared data
+    # is never read half-written
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(tmp_path / (name + '.npy'), np.ascontiguousarray(array))
+    with open(tmp_path / shared_meta_file, 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+
+    os.environ[shared_data_env] = str(path)
+    print('Shared data exported to %s' % path)
+
+    return path
+
+def __attach__(path):
+    '''
+    Attach to the data exported with `export_shared_data`.
+    '''
+    with open(path / shared_meta_file) as f:
+        meta = json.load(f)
+    arrays = {
+        file.stem: np.load(file, mmap_mode='r')
+        for file in path.glob('*.npy')
+    }
+
+    cube = {'axes': {}}
+    for name, array in arrays.items():
+        kind, key = name.split('_', 1) if '_' in name else (name, name)
+        if kind == 'cube':
+            cube[key] = array
+        elif kind == 'axis':
+            cube['axes'][key] = array
+
+    columns = {
+        column: arrays['df_' + column] for column in meta['columns']
+    }
+    columns['index'] = arrays['index']
+    return columns, meta, cube
+
+def __frame__(columns, meta):
+    '''
+    Assemble the DataFrame from the (shared) columns; only done when
+    the DataFrame itself is requested. pandas copies the columns into
+    its own blocks, so the DataFrame is private to the process.
+    '''
+    data = {}
+    for column in meta['columns']:
+        if column in meta['categories']:
+            data[column] = pd.Categorical.from_codes(
+                columns[column], meta['categories'][column])
+        else:
+            data[column] = columns[column]
+    return pd.DataFrame(
+        data, index=pd.Index(columns['index'], name=meta['index']))
+
+def __load__():
+    '''
+    Load the data and its derived indexes, once per process;
+    concurrent callers wait for the first load to complete.
+
+    If the data has been exported with `export_shared_data`,
+    attach to it instead.
+    '''
+    if 'cube' not in __context__:
+        with __lock__:
+            if 'cube' not in __context__:
+                path = os.environ.get(shared_data_env)
+                if path is not None and (Path(path) / shared_meta_file).is_file():
+                    columns, meta, cube = __attach__(Path(path))
+                    __context__['columns'] = columns
+                    __context__['meta'] = meta
+                else:
+                    df = parse_all_data()
+                    cube = get_cube(df)
+                    for array in list(cube.values()) + list(cube['axes'].values()):
+                        if isinstance(array, np.ndarray):
+                            array.flags.writeable = False
+                    __context__['df'] = df
+                __context__['TimeDeltaValues'] = tuple(
+                    cube['axes']['TimeDelta'].tolist())
+                # Set last: marks the context as loaded
+                __context__['cube'] = cube
+    return __context__
@@ -0,0 +1,429 @@
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from src.helpers import Modes
+from src.preprocess import group_PRR, median_CI, trace_PowerDelta_values
+
+# Axes of the PRR cube, in storage order
+cube_axes = ['SamePayload','TransPair','Mode','PowerDelta','TimeDelta']
+
+# Axes of the settings along which the runs are sorted by raw power delta
+# (see `get_delta_trace`), and span of the raw power deltas in the keys
+# of this index, in dB
+delta_axes = ['SamePayload','TransPair','Mode','TimeDelta']
+delta_key_span = 1024
+
+# Confidence level of the CI stored in the cube
+cube_confidence = 75
+
+# Cubes built in this process, by id of the DataFrame they are built from
+__cubes__ = {}
+
+# CI bounds at other confidence levels or with other methods,
+# by id of the cube, level and method
+__cube_CIs__ = {}
+
+# Traces of binned power deltas, least recently used first
+__delta_traces__ = OrderedDict()
+delta_cache_size = 256
+
+
+def build_cube(df, ci_method='thompson'):
+    '''
+    Build the "PRR cube" of the preprocessed data `df` (see `parse_all_data`):
+    a dense, array-backed view of the data indexed by
+    [SamePayload, TransPair, Mode, PowerDelta, TimeDelta].
+
+    Returns a dict with
+    + 'axes': the values along each of the `cube_axes`
+    (the TransPair axis ends with 'all', for all pairs combined)
+    + 'median', 'LB', 'UB': the median PRR and its two-sided confidence
+    interval (`cube_confidence`, computed with `ci_method`, see
+    `median_CI`) for each setting; NaN if there are no or not enough
+    data points
+    + 'ci_method': the method of this confidence interval
+    + 'PRR', 'offsets': the PRR values of the runs, sorted by setting,
+    such that the values of the setting with flat index i are
+    PRR[offsets[i]:offsets[i+1]]
+    + 'delta_keys', 'delta_PRR': the runs with a power delta, sorted by
+    setting without power delta (flat index j along `delta_axes`) then
+    by raw power delta (RssiB - RssiA, not rounded); the keys are
+    j * delta_key_span + raw power delta
+    '''
+    groups, PRR, starts, counts = group_PRR(df)
+    median, LB, UB = median_CI(PRR, starts, counts, ci_method, cube_confidence)
+
+    axes = {
+        'SamePayload': np.sort(df['SamePayload'].unique()),
+        'TransPair': np.array(
+            sorted(df['TransPair'].unique()) + ['all'], dtype=object),
+        'Mode': np.array(sorted(Modes[mode]['id'] for mode in Modes)),
+        # (+ 0.0 merges the -0.0 and 0.0 power deltas)
+        'PowerDelta': np.sort(df['PowerDelta'].dropna().unique()) + 0.0,
+        'TimeDelta': np.sort(df['TimeDelta'].unique()),
+    }
+    shape = tuple(len(axes[axis]) for axis in cube_axes)
+
+    # Flat index of each setting in the cube
+    flat = np.ravel_multi_index(
+        [pd.Index(axes[axis]).get_indexer(groups[axis].values)
+         for axis in cube_axes],
+        shape)
+
+    cube = {'axes': axes, 'ci_method': ci_method}
+    for name, values in [('median', median), ('LB', LB), ('UB', UB)]:
+        cube[name] = np.full(shape, np.nan)
+        cube[name].flat[flat] = values
+
+    # PRR values of the runs, ordered by flat index
+    cell_counts = np.zeros(np.prod(shape), dtype=np.int64)
+    cell_counts[flat] = counts
+    cube['offsets'] = np.concatenate([[0], np.cumsum(cell_counts)])
+    order = np.argsort(flat, kind='mergesort')
+    cube['PRR'] = PRR[__segments__(starts[order], counts[order])]
+
+    # Runs sorted by raw power delta, for each setting without power delta;
+    # the runs of all pairs are repeated with the 'all' pair
+    raw = df[df['PowerDelta'].notna()]
+    delta = (raw['RssiB'].values - raw['RssiA'].values).astype('float64')
+    if len(delta) and np.abs(delta).max() >= delta_key_span / 2:
+        raise ValueError('Power deltas out of the span of the delta index')
+    delta_shape = tuple(len(axes[axis]) for axis in delta_axes)
+    coords = [pd.Index(axes[axis]).get_indexer(np.asarray(raw[axis]))
+              for axis in delta_axes]
+    all_pairs = np.full(len(raw), len(axes['TransPair']) - 1)
+    segments = np.concatenate([
+        np.ravel_multi_index(coords, delta_shape),
+        np.ravel_multi_index([coords[0], all_pairs] + coords[2:], delta_shape)])
+    delta = np.tile(delta, 2)
+    order = np.lexsort((delta, segments))
+    cube['delta_keys'] = segments[order] * float(delta_key_span) + delta[order]
+    cube['delta_PRR'] = np.tile(raw['PRR'].values, 2)[order]
+
+    return cube
+
+def get_cube(df):
+    '''
+    Return the PRR cube of `df`, built on the first call only.
+    The DataFrame must not be modified afterwards.
+
+    `df` can also be a PRR cube, which is then returned as is.
+    '''
+    if isinstance(df, dict):
+        return df
+    entry = __cubes__.get(id(df))
+    if entry is None or entry[0] is not df:
+        entry = (df, build_cube(df))
+        __cubes__[id(df)] = entry
+    return entry[1]
+
+def get_cube_trace(cube, TransPair, SamePayload, Mode, axis, Delta,
+                   confidence=cube_confidence, ci_method='thompson'):
+    '''
+    Return the median PRR and CI bounds (two-sided, at the `confidence`
+    level, computed with `ci_method`, see `get_cube_CI`) of mode `Mode`
+    (ID) as a function of `axis` ('TimeDelta' or 'PowerDelta'), the other
+    delta being set to `Delta`, as a dict of arrays (x, median, LB, UB).
+
+    If `Mode` is None, the median and CI arrays have one row per mode
+    of the cube (in the order of cube['axes']['Mode']).
+
+    As in the traces files (see `computeTraces`), the traces as a function
+    of the power delta span `trace_PowerDelta_values` (NaN where there is
+    no data).
+
+    Returns None if there is no such setting.
+    '''
+    other = 'PowerDelta' if axis == 'TimeDelta' else 'TimeDelta'
+    index = __cube_index__(cube, TransPair, SamePayload,
+        slice(None) if Mode is None else Mode,
+        **{other: Delta, axis: slice(None)})
+    if index is None:
+        return None
+
+    LB, UB = get_cube_CI(cube, confidence, ci_method)
+    trace = {
+        'x': cube['axes'][axis],
+        'median': cube['median'][index],
+        'LB': LB[index],
+        'UB': UB[index],
+    }
+    if axis == 'PowerDelta':
+        positions = pd.Index(trace['x']).get_indexer(trace_PowerDelta_values)
+        found = positions >= 0
+        for name in ['median', 'LB', 'UB']:
+            values = np.full(trace[name].shape[:-1] + (len(positions),), np.nan)
+            values[..., found] = trace[name][..., positions[found]]
+            trace[name] = values
+        trace['x'] = trace_PowerDelta_values.astype(trace['x'].dtype)
+    return trace
+
+def get_cube_CI(cube, confidence, ci_method='thompson'):
+    '''
+    Return the arrays of CI bounds (two-sided, at the `confidence` level,
+    computed with `ci_method`, see `median_CI`) on the median PRR of all
+    the settings of the cube.
+
+    Bounds other than those stored in the cube are computed on the
+    first request from the sorted PRR values of the cube, then cached.
+    '''
+    if confidence == cube_confidence and ci_method == cube['ci_method']:
+        return cube['LB'], cube['UB']
+
+    key = (id(cube), confidence, ci_method)
+    entry = __cube_CIs__.get(key)
+    if entry is None or entry[0] is not cube:
+        starts = cube['offsets'][:-1]
+        counts = np.diff(cube['offsets'])
+        cells = np.flatnonzero(counts)
+        _, LB_cells, UB_cells = median_CI(
+            cube['PRR'], starts[cells], counts[cells], ci_method, confidence)
+        LB = np.full(cube['median'].shape, np.nan)
+        UB = np.full(cube['median'].shape, np.nan)
+        LB.flat[cells] = LB_cells
+        UB.flat[cells] = UB_cells
+        entry = (cube, LB, UB)
+        __cube_CIs__[key] = entry
+    return entry[1], entry[2]
+
+def get_cube_points(cube, TransPair, SamePayload, Mode, PowerDelta=None, TimeDelta=None):
+    '''
+    Return the data points (one per run) of mode `Mode` (ID), for all
+    modes (resp. power deltas, time deltas) if `Mode` (resp. `PowerDelta`,
+    `TimeDelta`) is None, as a dict of arrays (Mode, PowerDelta,
+    TimeDelta, PRR).
+
+    The arrays are empty if there is no such setting.
+    '''
+    index = __cube_index__(cube, TransPair, SamePayload,
+        slice(None) if Mode is None else Mode,
+        PowerDelta=slice(None) if PowerDelta is None else PowerDelta,
+        TimeDelta=slice(None) if TimeDelta is None else TimeDelta)
+
+    axes = cube['axes']
+    shape = cube['median'].shape
+    if index is None:
+        cells = np.zeros(0, dtype=np.int64)
+    else:
+        cells = np.ravel_multi_index(np.ix_(*[
+            np.arange(length)[i] if isinstance(i, slice) else [i]
+            for i, length in zip(index, shape)]), shape).ravel()
+
+    # Gather the values of the selected settings
+    starts = cube['offsets'][cells]
+    counts = cube['offsets'][cells+1] - starts
+    coords = np.unravel_index(np.repeat(cells, counts), shape)
+
+    return {
+        'Mode': axes['Mode'][coords[2]],
+        'PowerDelta': axes['PowerDelta'][coords[3]],
+        'TimeDelta': axes['TimeDelta'][coords[4]],
+        'PRR': cube['PRR'][__segments__(starts, counts)],
+    }
+
+def power_delta_bin(PowerDelta, powerBin):
+    '''
+    Return the ranges of raw power deltas selected by `powerBin` around
+    `PowerDelta`, as a tuple of intervals (lo, hi) for [lo, hi), or
+    (lo, hi, True) for [lo, hi]:
+    + a bin width in dB: [PowerDelta - width/2, PowerDelta + width/2)
+    + 'min': all power deltas with |power delta| >= |PowerDelta|
+    '''
+    if powerBin == 'min':
+        PowerDelta = abs(PowerDelta)
+        if PowerDelta == 0:
+            return ((-np.inf, np.inf),)
+        return ((-np.inf, -PowerDelta, True), (PowerDelta, np.inf))
+    return ((PowerDelta - powerBin / 2, PowerDelta + powerBin / 2),)
+
+def get_delta_trace(cube, TransPair, SamePayload, Mode, ranges,
+                    confidence=cube_confidence, ci_method='thompson'):
+    '''
+    Return the median PRR and CI bounds (see `get_cube_CI`) of mode
+    `Mode` (ID) as a function of the time delta, computed over the runs whose raw power delta is
+    in one of the `ranges` (see `power_delta_bin`), as a dict of arrays
+    (x, median, LB, UB).
+
+    Returns None if there is no such setting.
+    '''
+    def compute():
+        segments = __delta_segments__(cube, TransPair, SamePayload, Mode)
+        if segments is None:
+            return None
+        median, LB, UB = __delta_stats__(cube, segments, [ranges], confidence, ci_method)
+        return {
+            'x': cube['axes']['TimeDelta'],
+            'median': median[:, 0],
+            'LB': LB[:, 0],
+            'UB': UB[:, 0],
+        }
+    return __cached__(cube,
+        ('TimeDelta', TransPair, SamePayload, Mode, tuple(ranges), confidence, ci_method),
+        compute)
+
+def get_binned_trace(cube, TransPair, SamePayload, Mode, TimeDelta, width,
+                     confidence=cube_confidence, ci_method='thompson'):
+    '''
+    Return the median PRR and CI bounds (see `get_cube_CI`) of mode
+    `Mode` (ID) as a function of the power delta, with the runs binned by raw power delta in bins
+    of `width` dB centered on the multiples of `width`, as a dict of
+    arrays (x, median, LB, UB).
+
+    Returns None if there is no such setting.
+    '''
+    def compute():
+        segments = __delta_segments__(cube, TransPair, SamePayload, Mode, TimeDelta)
+        if segments is None:
+            return None
+        # Bins covering the power deltas before rounding
+        values = cube['axes']['PowerDelta']
+        centers = width * np.arange(
+            np.floor((values.min() - 0.5) / width),
+            np.ceil((values.max() + 0.5) / width) + 1)
+        bins = [((center - width / 2, center + width / 2),) for center in centers]
+        median, LB, UB = __delta_stats__(cube, segments, bins, confidence, ci_method)
+        return {
+            'x': centers,
+            'median': median[0],
+            'LB': LB[0],
+            'UB': UB[0],
+        }
+    return __cached__(cube,
+        ('PowerDelta', TransPair, SamePayload, Mode, TimeDelta, width, confidence, ci_method),
+        compute)
+
+def get_delta_points(cube, TransPair, SamePayload, Mode, ranges=None, TimeDelta=None):
+    '''
+    Return the data points (one per run) of mode `Mode` (ID) with their
+    raw power delta, for the power deltas in one of the `ranges` (all
+    if None) and for all time deltas if `TimeDelta` is None, as a dict
+    of arrays (PowerDelta, TimeDelta, PRR).
+    '''
+    segments = __delta_segments__(cube, TransPair, SamePayload, Mode, TimeDelta)
+    if segments is None:
+        segments = np.zeros(0, dtype=np.int64)
+    if ranges is None:
+        ranges = ((-np.inf, np.inf),)
+    _, rows = __delta_select__(cube, segments, [ranges])
+
+    keys = cube['delta_keys'][rows]
+    segments = np.round(keys / delta_key_span)
+    TimeDeltas = cube['axes']['TimeDelta']
+    return {
+        'PowerDelta': keys - segments * delta_key_span,
+        'TimeDelta': TimeDeltas[segments.astype(np.int64) % len(TimeDeltas)],
+        'PRR': cube['delta_PRR'][rows],
+    }
+
+def __delta_segments__(cube, TransPair, SamePayload, Mode, TimeDelta=None):
+    '''
+    Flat indexes along `delta_axes` of the settings of mode `Mode` (ID),
+    for all time deltas if `TimeDelta` is None.
+
+    Returns None if there is no such setting.
+    '''
+    index = __cube_index__(cube, TransPair, SamePayload, Mode,
+        PowerDelta=slice(None),
+        TimeDelta=slice(None) if TimeDelta is None else TimeDelta)
+    if index is None:
+        return None
+    TimeDeltas = np.arange(len(cube['axes']['TimeDelta']))[index[4]]
+    shape = tuple(len(cube['axes'][axis]) for axis in delta_axes)
+    return np.ravel_multi_index(
+        (index[0], index[1], index[2], np.atleast_1d(TimeDeltas)), shape)
+
+def __delta_select__(cube, segments, bins):
+    '''
+    Select the runs of the `segments` (flat indexes along `delta_axes`)
+    with a raw power delta in each of the `bins` (tuples of disjoint
+    ranges, see `power_delta_bin`), with one binary search per range bound.
+
+    Returns the group of each selected run (segment i and bin j being
+    group i * len(bins) + j), in increasing order, and its row in the
+    delta index.
+    '''
+    ranges = [(j,) + tuple(r) for j, ranges in enumerate(bins) for r in ranges]
+    bin_ids = np.array([r[0] for r in ranges], dtype=np.int64)
+    closed = np.array([len(r) > 3 and bool(r[3]) for r in ranges])
+    bound = delta_key_span / 2
+    lo = np.clip([r[1] for r in ranges], -bound, bound)
+    hi = np.clip([r[2] for r in ranges], -bound, bound)
+
+    keys = cube['delta_keys']
+    base = np.asarray(segments, dtype='float64')[:, None] * delta_key_span
+    starts = np.searchsorted(keys, base + lo).ravel()
+    stops = np.where(closed,
+        np.searchsorted(keys, base + hi, side='right'),
+        np.searchsorted(keys, base + hi)).ravel()
+    counts = np.maximum(stops - starts, 0)
+
+    groups = (np.arange(len(segments))[:, None] * len(bins) + bin_ids).ravel()
+    return np.repeat(groups, counts), __segments__(starts, counts)
+
+def __delta_stats__(cube, segments, bins, confidence, ci_method='thompson'):
+    '''
+    Median PRR and CI bounds of the runs selected by `__delta_select__`,
+    as arrays of shape (len(segments), len(bins)); NaN if there are no
+    or not enough runs.
+    '''
+    groups, rows = __delta_select__(cube, segments, bins)
+    n_groups = len(segments) * len(bins)
+
+    # Sort the PRR values of each group
+    values = cube['delta_PRR'][rows]
+    values = values[np.lexsort((values, groups))]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    cells = np.flatnonzero(counts)
+
+    stats = [np.full(n_groups, np.nan) for _ in range(3)]
+    if len(cells):
+        for stat, values in zip(stats, median_CI(
+                values, starts[cells], counts[cells], ci_method, confidence)):
+            stat[cells] = values
+    return [stat.reshape(len(segments), len(bins)) for stat in stats]
+
+def __cached__(cube, key, compute):
+    '''
+    Return the result of `compute` for the `key` of `cube`, from the
+    least-recently-used cache of the delta traces if possible.
+    '''
+    key = (id(cube),) + key
+    entry = __delta_traces__.get(key)
+    if entry is not None and entry[0] is cube:
+        __delta_traces__.move_to_end(key)
+        return entry[1]
+    result = compute()
+    __delta_traces__[key] = (cube, result)
+    if len(__delta_traces__) > delta_cache_size:
+        __delta_traces__.popitem(last=False)
+    return result
+
+def __cube_index__(cube, TransPair, SamePayload, Mode, PowerDelta, TimeDelta):
+    '''
+    Convert axis values into an index of the cube arrays;
+    slices are passed through.
+
+    Returns None if one of the values is not in the cube.
+    '''
+    values = [SamePayload, TransPair, Mode, PowerDelta, TimeDelta]
+    index = []
+    for axis, value in zip(cube_axes, values):
+        if isinstance(value, slice):
+            index.append(value)
+            continue
+        match = np.flatnonzero(cube['axes'][axis] == value)
+        if len(match) == 0:
+            return None
+        index.append(match[0])
+    return tuple(index)
+
+def __segments__(starts, counts):
+    '''
+    Indices of the concatenation of the ranges
+    [starts[i], starts[i]+counts[i]).
+    '''
+    shift = starts - (np.cumsum(counts) - counts)
+    return np.repeat(shift, counts) + np.arange(counts.sum())
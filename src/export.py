@@ -0,0 +1,262 @@
+'''
+Batch export of figures to static files, to be run from the repository root:
+
+    python -m src.export [--jobs N] [--force] [--dry-run] [--specs FILE]
+                         [--formats FORMAT ...] [name ...]
+
+Each figure is described by a spec (see `paper_figures`, or a JSON file
+holding a list of specs), with
++ name: name of the output files, `figures/<name>.<format>`
++ function: plotting function of `src/plots.py`
++ parameters: parameters of the function, except the data
++ layout (optional): layout update, applied as in the tabs
+
+The figures are rendered in parallel to the requested formats (html,
+json, and png or svg if kaleido is installed). The json files of the
+default figures of the application are embedded in the layouts of the
+tabs (see `prebuild` and `load_figure`). A figure is only rendered
+again if its spec, the preprocessed data, or the plotting code changed
+since its last export, or if one of its files is missing or modified;
+these fingerprints are saved in `figures/export.json`.
+'''
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+import json
+import time
+from pathlib import Path
+
+import pandas as pd
+import plotly.io as pio
+
+from src.helpers import Modes, inputs_fingerprint, output_record, is_stale, read_state, write_state
+from src.preprocess import all_csv_file, all_snapshot_file
+import src.plots as plots
+
+output_path = Path('figures')
+export_file = 'export.json'
+formats = ['html', 'json', 'png', 'svg']
+
+# Files whose changes invalidate all the figures
+data_files = [
+    Path('data_preprocessed') / all_snapshot_file,
+    Path('data_preprocessed') / all_csv_file,
+]
+code_files = [Path('src') / name for name in
+    ['export.py', 'plots.py', 'cube.py', 'preprocess.py', 'stats.py',
+     'helpers.py', 'colors.py']]
+
+# Figures of the paper, as shown by default in the tabs (see `load_figure`)
+__all_modes__ = [mode for mode in Modes]
+__interference_layout__ = dict(
+    showlegend = False,
+    margin = dict(t=150),
+    xaxis = {'tickvals':[-16,-8,0,8,16]},
+)
+paper_figures = [
+    dict(name='general_TimeDelta', function='prr_f_TimeDelta',
+         parameters=dict(PowerDelta=0, SamePayload=1, TransPair='all',
+                         ModesToShow=__all_modes__, powerBin=0),
+         layout=dict(xaxis={'range':[-120,120]})),
+    dict(name='general_PowerDelta', function='prr_f_PowerDelta',
+         parameters=dict(TimeDelta=0, SamePayload=1, TransPair='all',
+                         ModesToShow=__all_modes__, powerBin=0)),
+    dict(name='general_3d', function='prr_3d',
+         parameters=dict(SamePayload=1, TransPair='all',
+                         ModesToShow=__all_modes__)),
+    dict(name='matrix', function='prr_matrix_plot',
+         parameters=dict(PowerDeltaList=[0,2,4,6,8,10], SamePayload=1,
+                         ModesToShow=__all_modes__, rowHeight=250),
+         layout=dict(margin=dict(t=100), xaxis={'tickvals':[-16,-8,0,8,16]})),
+] + [
+    dict(name='constructiveInterference_%s' % name,
+         function='prr_f_TimeDelta',
+         parameters=dict(PowerDelta=0, SamePayload=SamePayload, TransPair='all',
+                         ModesToShow=[mode], showMarkers=True,
+                         showTimeThreshold=True),
+         layout=dict(__interference_layout__, title=Modes[mode]['label'] + title))
+    for name, mode, SamePayload, title in [
+        ('BLE2M', 'BLE_2M', 1, ''),
+        ('BLE1M', 'BLE_1M', 1, ''),
+        ('BLE500k', 'BLE_500K', 1, ''),
+        ('BLE125k', 'BLE_125K', 1, ''),
+        ('ZigBeeSamePacket', 'ZigBee', 1, '<br>Same packet content'),
+        ('ZigBeeDiffPacket', 'ZigBee', 0, '<br>Different packet content')]
+] + [
+    dict(name='powerCapture_%s' % name,
+         function='prr_f_PowerDelta',
+         parameters=dict(TimeDelta=0, SamePayload=SamePayload, TransPair='all',
+                         ModesToShow=__all_modes__, powerBin=0))
+    for name, SamePayload in [('SamePacket', 1), ('DiffPacket', 0)]
+]
+
+__functions__ = ['prr_f_TimeDelta', 'prr_f_PowerDelta', 'prr_3d', 'prr_matrix_plot']
+
+
+def render(spec, formats=['html']):
+    '''
+    Render the figure of a spec to `output_path`, in the given formats.
+    Returns the duration of the rendering.
+    '''
+    start = time.perf_counter()
+    figure = __figure__(spec)
+    for format in formats:
+        file_path = __output_file__(spec, format)
+        if format == 'html':
+            pio.write_html(figure, str(file_path), include_plotlyjs='cdn',
+                           include_mathjax='cdn')
+        elif format == 'json':
+            with open(file_path, 'w') as f:
+                f.write(plots.figure_json(figure))
+        else:
+            pio.write_image(figure, str(file_path), format=format)
+    return time.perf_counter() - start
+
+def export(specs=None, selected=None, formats=['html'], n_jobs=1, force=False, dry_run=False):
+    '''
+    Export the figures of the `specs` (`paper_figures` by default), or only
+    the `selected` ones (by name), in parallel using `n_jobs` processes
+    (n_jobs=None uses all the available cores). Pass `force=True` to
+    render all figures, even those that are up to date.
+
+    Returns a DataFrame with, per figure, whether it was rendered and
+    the time spent.
+    '''
+    if specs is None:
+        specs = paper_figures
+    if selected:
+        specs = [spec for spec in specs if spec['name'] in selected]
+
+    # Static images need kaleido
+    if any(format in ['png', 'svg'] for format in formats) and importlib.util.find_spec('kaleido') is None:
+        print('kaleido is not installed: not exporting to png and svg')
+        formats = [format for format in formats if format not in ['png', 'svg']]
+
+    output_path.mkdir(exist_ok=True)
+    state = read_state(output_path / export_file, 'outputs')
+    cache = state['files']
+
+    # Formats of each figure to render
+    stale = []
+    for spec in specs:
+        fingerprint = __fingerprint__(spec, cache)
+        stale_formats = [
+            format for format in formats
+            if force or __is_stale__(spec, format, fingerprint, state)
+        ]
+        if stale_formats:
+            stale.append((spec, fingerprint, stale_formats))
+    print('%i figure(s), %i to render' % (len(specs), len(stale)))
+    if dry_run:
+        for spec, _, stale_formats in stale:
+            print('\t%s (%s)' % (spec['name'], ', '.join(stale_formats)))
+        return
+
+    start = time.perf_counter()
+    stale_specs = [spec for spec, _, _ in stale]
+    stale_formats = [stale_formats for _, _, stale_formats in stale]
+    if n_jobs == 1 or len(stale) <= 1:
+        durations = list(map(render, stale_specs, stale_formats))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            durations = list(executor.map(render, stale_specs, stale_formats))
+
+    # Record the state of the rendered files
+    for spec, fingerprint, spec_formats in stale:
+        for format in spec_formats:
+            file_path = __output_file__(spec, format)
+            state['outputs'][str(file_path)] = output_record(
+                fingerprint, [file_path], cache)
+    write_state(output_path / export_file, state)
+
+    rendered = dict(zip([spec['name'] for spec in stale_specs], durations))
+    summary = pd.DataFrame(
+        [(spec['name'], spec['name'] in rendered, rendered.get(spec['name'], 0.0))
+         for spec in specs],
+        columns=['Figure', 'Rendered', 'Time [s]']
+        ).set_index('Figure')
+    print()
+    print(summary.to_string(float_format='%.2f'))
+    print('\nTotal: %.2f s' % (time.perf_counter() - start))
+    return summary
+
+def prebuild():
+    '''
+    Prebuild the figures of `paper_figures` in json format, to be embedded
+    in the layouts of the tabs (see `load_figure`); only the figures that
+    are out of date are rendered.
+    '''
+    return export(formats=['json'])
+
+def load_figure(name):
+    '''
+    Return the figure `name` of `paper_figures` as prebuilt by `prebuild`,
+    or render it if the prebuilt figure is missing or out of date.
+    '''
+    spec = next(spec for spec in paper_figures if spec['name'] == name)
+    file_path = __output_file__(spec, 'json')
+    state = read_state(output_path / export_file, 'outputs')
+    if not __is_stale__(spec, 'json', __fingerprint__(spec, state['files']), state):
+        with open(file_path) as f:
+            return json.load(f)
+    print('No prebuilt figure %s: rendering it' % name)
+    return __figure__(spec)
+
+def __figure__(spec):
+    '''
+    Build the figure of a spec, as a dict (see `new_figure` in src/plots.py).
+    '''
+    # Imported here: the data are loaded once per worker process
+    from src.context import get_data_cube
+
+    if spec['function'] not in __functions__:
+        raise ValueError('Unknown plotting function: %s' % spec['function'])
+    figure = getattr(plots, spec['function'])(
+        get_data_cube(), as_dict=True, **spec['parameters'])
+    if 'layout' in spec:
+        plots.update_layout(figure, spec['layout'])
+    return figure
+
+def __output_file__(spec, format):
+    return output_path / ('%s.%s' % (spec['name'], format))
+
+def __fingerprint__(spec, cache):
+    '''
+    Fingerprint of the inputs of a figure: its spec, and the files
+    shared by all figures.
+    '''
+    return inputs_fingerprint(data_files + code_files, cache, json.dumps(spec, sort_keys=True))
+
+def __is_stale__(spec, format, fingerprint, state):
+    '''
+    Whether the file of a spec in `format` must be rendered again
+    (the records of the files are kept by path in state['outputs']).
+    '''
+    file_path = __output_file__(spec, format)
+    record = state['outputs'].get(str(file_path))
+    return is_stale(fingerprint, record, [file_path], state['files'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export the figures to static files.')
+    parser.add_argument('names', nargs='*',
+        help='names of the figures to export (default: all)')
+    parser.add_argument('-s', '--specs',
+        help='JSON file with the list of figure specs (default: the paper figures)')
+    parser.add_argument('--formats', nargs='+', default=['html'],
+        help='output formats, among %s (default: html)' % ', '.join(formats))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of parallel processes (0: all cores)')
+    parser.add_argument('-f', '--force', action='store_true',
+        help='render all figures')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+        help='only list the figures to render')
+    args = parser.parse_args()
+    for format in args.formats:
+        if format not in formats:
+            parser.error('unknown format: %s' % format)
+    specs = None
+    if args.specs is not None:
+        with open(args.specs) as f:
+            specs = json.load(f)
+    export(specs, args.names, args.formats, args.jobs or None, args.force, args.dry_run)
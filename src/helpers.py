@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 import src.colors as colors
 
 Modes = dict(
@@ -60,3 +63,82 @@ Parameters = dict(
             all = dict(path = 'transmitter_pair_all'),
     ),
 )
+
+# Confidence levels (two-sided, in %) offered for the CI on the median PRR
+ConfidenceLevels = [50, 75, 90, 95, 99]
+
+# Binnings of the power delta offered in the tabs (see `power_delta_bin`
+# in src/cube.py); 0 keeps the whole dB values of the preprocessed data
+PowerDeltaBins = [
+    dict(label='Whole dB', value=0),
+    dict(label='2 dB bins', value=2),
+    dict(label='4 dB bins', value=4),
+]
+
+
+def file_hash(file_path, cache):
+    '''
+    Return the sha1 of a file, or None if it does not exist.
+    Hashes are cached in the dict `cache` (e.g., saved with the state of
+    a build) by path, size, and modification time.
+    '''
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
+        return None
+    entry = cache.get(str(file_path))
+    if (entry is not None and entry['size'] == stat.st_size
+            and entry['mtime'] == stat.st_mtime):
+        return entry['sha1']
+    with open(file_path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    cache[str(file_path)] = dict(size=stat.st_size, mtime=stat.st_mtime, sha1=sha1)
+    return sha1
+
+def inputs_fingerprint(file_paths, cache, salt=''):
+    '''
+    Fingerprint of a list of input files (their paths and sha1, see
+    `file_hash`), prefixed by the string `salt`.
+    '''
+    sha1 = hashlib.sha1(salt.encode())
+    for file_path in file_paths:
+        sha1.update(str(file_path).encode())
+        sha1.update(str(file_hash(file_path, cache)).encode())
+    return sha1.hexdigest()
+
+def output_record(fingerprint, output_paths, cache):
+    '''
+    Record of outputs built from inputs of fingerprint `fingerprint`
+    (see `inputs_fingerprint`), with the sha1 of each output file.
+    '''
+    return dict(
+        inputs=fingerprint,
+        outputs={str(file_path): file_hash(file_path, cache) for file_path in output_paths})
+
+def is_stale(fingerprint, record, output_paths, cache):
+    '''
+    Whether outputs recorded as `record` (see `output_record`, None if
+    they were never built) must be built again: their inputs changed,
+    or one of the output files is missing or was modified.
+    '''
+    if record is None or record['inputs'] != fingerprint:
+        return True
+    return any(
+        file_hash(file_path, cache) != record['outputs'].get(str(file_path))
+        for file_path in output_paths)
+
+def read_state(state_path, records):
+    '''
+    Read the state of a build saved with `write_state`: a dict with the
+    hash cache of `file_hash` ('files') and the dict `records` of output
+    records (see `output_record`); both are empty if there is no state.
+    '''
+    state = {'files': {}, records: {}}
+    if state_path.is_file():
+        with open(state_path) as f:
+            state.update(json.load(f))
+    return state
+
+def write_state(state_path, state):
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=1)
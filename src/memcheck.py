@@ -0,0 +1,111 @@
+'''
+Check that the data exported with `export_shared_data` is shared between
+the worker processes, to be run from the repository root (Linux only):
+
+    python -m src.memcheck [--workers N ...]
+
+For each number of workers, the workers attach to the shared data (as
+the gunicorn workers do, see `gunicorn.conf.py`) and read all of the
+cube. The memory of the processes is then read from `/proc/<pid>/smaps`:
+the RSS counts the shared pages once per process, while the PSS splits
+them between the processes sharing them. The total PSS of the shared
+data files must stay about flat with the number of workers.
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+from src.context import export_shared_data, get_data_cube, shared_data_env
+
+
+def check(workers=[1, 2, 4], tolerance=0.1):
+    '''
+    Start each number of `workers` in turn and measure their memory.
+    Returns True if the total PSS of the shared data varies by less than
+    `tolerance` (relative) between the numbers of workers.
+    '''
+    if not Path('/proc/self/smaps').is_file():
+        print('/proc/<pid>/smaps is not available: cannot measure the memory')
+        return None
+
+    path = Path(export_shared_data()).resolve()
+    context = multiprocessing.get_context('spawn')
+
+    results = []
+    for n_workers in workers:
+        stop = context.Event()
+        ready = [context.Event() for _ in range(n_workers)]
+        processes = [
+            context.Process(target=__worker__, args=(path, event, stop))
+            for event in ready
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for event, process in zip(ready, processes):
+                while not event.wait(1):
+                    if not process.is_alive():
+                        raise RuntimeError('A worker process failed')
+            memory = [__memory__(process.pid, path) for process in processes]
+        finally:
+            stop.set()
+            for process in processes:
+                process.join()
+        results.append([n_workers] + list(np.sum(memory, axis=0) / 1024))
+
+    summary = pd.DataFrame(
+        results,
+        columns=['Workers', 'RSS [MB]', 'PSS [MB]', 'Data RSS [MB]', 'Data PSS [MB]']
+        ).set_index('Workers')
+    print()
+    print(summary.to_string(float_format='%.1f'))
+
+    data = summary['Data PSS [MB]']
+    flat = bool(data.max() - data.min() <= tolerance * data.min())
+    print('\nThe shared data %s in memory once (%.1f to %.1f MB in total)' % (
+        'is' if flat else 'is NOT', data.min(), data.max()))
+    return flat
+
+def __worker__(path, ready, stop):
+    '''
+    Attach to the shared data, read all of the cube, and wait.
+    '''
+    os.environ[shared_data_env] = str(path)
+    cube = get_data_cube()
+    for array in list(cube.values()) + list(cube['axes'].values()):
+        if isinstance(array, np.ndarray):
+            array.reshape(-1).view(np.uint8).sum()
+    ready.set()
+    stop.wait()
+
+def __memory__(pid, path):
+    '''
+    RSS and PSS of a process, in total and for the shared data files, in kB.
+    '''
+    memory = dict(Rss=[0, 0], Pss=[0, 0])
+    shared = False
+    with open('/proc/%i/smaps' % pid) as f:
+        for line in f:
+            fields = line.split()
+            if not fields[0].endswith(':'):
+                # Header of a mapping: address, perms, offset, dev, inode, [path]
+                shared = len(fields) > 5 and fields[5].startswith(str(path))
+            elif fields[0][:-1] in memory:
+                values = memory[fields[0][:-1]]
+                values[0] += int(fields[1])
+                if shared:
+                    values[1] += int(fields[1])
+    return [memory['Rss'][0], memory['Pss'][0], memory['Rss'][1], memory['Pss'][1]]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check that the shared data is held in memory once.')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4],
+        help='numbers of worker processes to compare (default: 1 2 4)')
+    args = parser.parse_args()
+    sys.exit(0 if check(args.workers) is not False else 1)
@@ -1,19 +1,45 @@
-from pathlib import Path
+import copy
+import json
+from functools import lru_cache
 
-import pandas as pd
 import numpy as np
 
 import plotly.graph_objects as go
 import plotly.io as pio
 pio.templates.default = "none"
 from plotly.subplots import make_subplots
-
-from src.helpers import Modes, Parameters
+from plotly.utils import PlotlyJSONEncoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from src.helpers import Modes
+from src.cube import (
+    get_cube,
+    get_cube_trace,
+    get_cube_points,
+    get_delta_trace,
+    get_binned_trace,
+    get_delta_points,
+    power_delta_bin,
+)
+from src.cache import cached_figure
 import src.colors as colors
 
 
 markerSize = 3
+# Maximum size of the markers collapsing several runs
+markerSizeMax = 12
 markerOpacity = 0.3
+# Marker traces with more markers are rendered with WebGL
+webglThreshold = 1000
+# Maximum number of points of the 3D plot, and the voxel sizes
+# (PowerDelta [dB], PRR [%]) of its successive levels of detail
+# (0: runs with the same values only); see `__prep_3d_plot__`
+pointBudget3d = 15000
+voxelSizes3d = [(0, 0), (2, 10), (4, 20)]
+markerSizeMax3d = 12
 CI_opacity = 0.8
 base_layout =  dict(
     title={
@@ -38,17 +64,87 @@ base_layout =  dict(
     uirevision = True
 )
 
+# Layout template of the figures (see `new_figure`)
+__template__ = go.Figure().to_dict()['layout'].get('template', {})
+
 
+def new_figure(data, layout):
+    '''
+    Assemble a figure as a plain dict, ready to be returned by a Dash
+    callback or serialized with `figure_json`.
+
+    Plotly does not validate such figures: the traces (dicts, scatter
+    by default) and the layout must only use valid properties.
+    '''
+    return {
+        'data': [{'type': 'scatter', **trace} for trace in data],
+        'layout': dict(layout, template=copy.deepcopy(__template__)),
+    }
+
+def update_layout(figure, layout):
+    '''
+    Update the layout of a figure built with `new_figure` in place, like
+    plotly's `Figure.update_layout`: nested properties are merged and
+    a string title sets the title text. Returns the figure.
+    '''
+    __merge__(figure['layout'], layout)
+    return figure
+
+def figure_json(figure):
+    '''
+    Serialize a figure built with `new_figure` to JSON, with orjson if
+    it is installed (NaN values are serialized as null, as by plotly).
+    '''
+    if orjson is not None:
+        return orjson.dumps(figure).decode()
+    return json.dumps(figure, cls=PlotlyJSONEncoder)
+
+def __merge__(target, update):
+    for key, value in update.items():
+        if key == 'title' and not isinstance(value, dict):
+            value = {'text': value}
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            __merge__(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+@lru_cache(maxsize=64)
+def __subplots_layout__(rows, cols):
+    '''
+    Layout of a grid of subplots (axes domains and anchors), as built
+    by plotly's `make_subplots`; the subplot (row, col) has the axes
+    number (row-1)*cols + col.
+    '''
+    layout = make_subplots(rows=rows, cols=cols).to_dict()['layout']
+    layout.pop('template', None)
+    return layout
+
+def __axis__(name, k):
+    '''
+    Reference of the axis `name` ('x' or 'y') of subplot number k.
+    '''
+    return name if k == 1 else '%s%i' % (name, k)
+
+def __axis_key__(name, k):
+    '''
+    Layout key of the axis `name` ('x' or 'y') of subplot number k.
+    '''
+    return name + 'axis' if k == 1 else '%saxis%i' % (name, k)
+
+
+@cached_figure
 def prr_matrix_plot(
     df,
-    DataPath,
+    DataPath = None,
     PowerDeltaList = [0,1,2,3,4],
     rowHeight = 100,
     ModesToShow = [x for x in Modes],
     custom_layout = None,
     showMarkers=False,
     showCI=True,
-    SamePayload=1
+    SamePayload=1,
+    confidence=75,
+    ci_method='thompson'
     ):
 
     # Initialization
@@ -56,10 +152,7 @@ def prr_matrix_plot(
     numRow = len(PowerDeltaList)
     numCol = len(ModeList)
     AnnotList = []
-    figure = make_subplots(
-        rows=numRow,
-        cols=numCol,
-        )
+    figure = new_figure([], copy.deepcopy(__subplots_layout__(numRow, numCol)))
 
     # Initialize layout
     default_layout = dict(
@@ -68,14 +161,14 @@ def prr_matrix_plot(
         height = (rowHeight*numRow),
         width = 2000,
     )
-    figure.update_layout(default_layout)
+    update_layout(figure, default_layout)
 
     # Apply custom layout if passed as an argument
     if custom_layout is not None:
-        figure.update_layout(custom_layout)
+        update_layout(figure, custom_layout)
 
     # convenience naming
-    layout = figure.layout
+    layout = figure['layout']
 
     # Compute the plot area width
     plot_width = (layout['width']
@@ -87,7 +180,7 @@ def prr_matrix_plot(
 
     # Setting column labels
     for j in range(numCol):
-        col_label = go.layout.Annotation(
+        col_label = dict(
                 x=((j+0.5)*1/numCol),
                 y=(1+layout['margin']['t']/plot_height),
                 xref="paper",
@@ -98,7 +191,7 @@ def prr_matrix_plot(
                 yanchor='top',
             )
         AnnotList.append(col_label)
-    col_label = go.layout.Annotation(
+    col_label = dict(
             x=-(layout['margin']['l']/plot_width),
             y=(1+layout['margin']['t']/plot_height),
             xref="paper",
@@ -110,10 +203,23 @@ def prr_matrix_plot(
         )
     AnnotList.append(col_label)
 
+    # Get the figure data, for all cells at once
+    cells = __prep_TimeDelta_matrix__(
+        df,
+        PowerDeltaList,
+        SamePayload=SamePayload,
+        TransPair='all',
+        ModesToShow=ModeList,
+        showMarkers=showMarkers,
+        showCI=showCI,
+        confidence=confidence,
+        ci_method=ci_method
+        )
+
     for i in range(numRow):
 
         # Set the row label
-        row_label = go.layout.Annotation(
+        row_label = dict(
                 x=-(layout['margin']['l']/plot_width),
                 y=(1 - (i+0.5)*1/numRow),
                 xref="paper",
@@ -126,74 +232,59 @@ def prr_matrix_plot(
         AnnotList.append(row_label)
 
         for j in range(numCol):
-
-            # Get the figure data
-            figure_data = __prep_TimeDelta_plot__(
-                df,
-                PowerDelta=PowerDeltaList[i],
-                SamePayload=SamePayload,
-                TransPair='all',
-                ModesToShow=[ModeList[j]],
-                DataPath=DataPath,
-                showMarkers=showMarkers,
-                showCI=showCI
-                )
-
-            # Add traces to the plot
-            for trace in figure_data["data"]:
-                figure.add_trace(
-                    trace,
-                    row=i+1,
-                    col=j+1)
+            # Add traces to the subplot
+            k = i*numCol + j + 1
+            for trace in cells[i][j]:
+                figure['data'].append({
+                    'type': 'scatter', **trace,
+                    'xaxis': __axis__('x', k),
+                    'yaxis': __axis__('y', k)})
 
     # Customize the layout
+    xaxes = [name for name in layout if name.startswith('xaxis')]
+    yaxes = [name for name in layout if name.startswith('yaxis')]
     ## X axis
     ### Default
-    figure.update_xaxes(
-        range=[-50,50],
-        )
-    figure.update_xaxes(
-        title_text='Transmitters Time Delta [ticks]',
-        row=numRow, col=3
-        )
+    for name in xaxes:
+        layout[name]['range'] = [-50,50]
+    if numCol >= 3:
+        update_layout(figure, {
+            __axis_key__('x', (numRow-1)*numCol + 3):
+                {'title': {'text': 'Transmitters Time Delta [ticks]'}}})
     ### Update with custom values
     if ((custom_layout is not None) and
         ('xaxis' in custom_layout)):
-        if ('tickvals' in custom_layout['xaxis']):
-            figure.update_xaxes(
-                tickvals=custom_layout['xaxis']['tickvals'],
-                )
-        if ('range' in custom_layout['xaxis']):
-            figure.update_xaxes(
-                range=custom_layout['xaxis']['range'],
-                )
+        for prop in ['tickvals', 'range']:
+            if (prop in custom_layout['xaxis']):
+                for name in xaxes:
+                    layout[name][prop] = copy.deepcopy(custom_layout['xaxis'][prop])
 
     ## Y axis
-    figure.update_yaxes(
-        range=[-3,103],
-        )
-    figure.update_yaxes(
-        title_text='PRR [%]',
-        col=1
-        )
+    for name in yaxes:
+        layout[name]['range'] = [-3,103]
+    for i in range(numRow):
+        update_layout(figure, {
+            __axis_key__('y', i*numCol + 1): {'title': {'text': 'PRR [%]'}}})
     ## Add the annotations
-    figure.update_layout(
-        annotations=AnnotList,
-        )
+    layout['annotations'] = AnnotList
 
     return figure
 
 
+@cached_figure
 def prr_f_TimeDelta(
     df,
     PowerDelta,
     SamePayload,
     TransPair,
     ModesToShow,
-    DataPath=Path('data_preprocessed'),
+    DataPath=None,
     showMarkers=False,
     showCI=True,
-    showTimeThreshold=False
+    showTimeThreshold=False,
+    confidence=75,
+    ci_method='thompson',
+    powerBin=None
     ):
 
     # Get the figure data
@@ -203,18 +294,26 @@ def prr_f_TimeDelta(
         SamePayload,
         TransPair,
         ModesToShow,
-        DataPath,
         showMarkers=showMarkers,
         showCI=showCI,
-        showTimeThreshold=showTimeThreshold
+        showTimeThreshold=showTimeThreshold,
+        confidence=confidence,
+        ci_method=ci_method,
+        powerBin=powerBin
         )
 
     if figure_data is None:
         return
 
     # Customize the layout
-    final_layout = figure_data["layout"].copy()
-    final_layout["title"]["text"] = ('PRR = f(Time Delta) <br> with Power Delta = %i dB' % PowerDelta)
+    final_layout = figure_data["layout"]
+    if not powerBin:
+        final_layout["title"]["text"] = ('PRR = f(Time Delta) <br> with Power Delta = %i dB' % PowerDelta)
+    elif powerBin == 'min':
+        final_layout["title"]["text"] = ('PRR = f(Time Delta) <br> with |Power Delta| ≥ %i dB' % abs(PowerDelta))
+    else:
+        final_layout["title"]["text"] = ('PRR = f(Time Delta) <br> with Power Delta in [%g, %g) dB'
+            % power_delta_bin(PowerDelta, powerBin)[0])
     final_layout["xaxis"]["title"]["text"] = ('Transmitters Time Delta [ticks]')
     # final_layout["xaxis"]["range"] = [-150,150]
     # final_layout["xaxis"]["range"] = [-50,50]
@@ -224,24 +323,28 @@ def prr_f_TimeDelta(
     final_layout["margin"] = {'t':150}
 
     # Generate the figure
-    figure = go.Figure()
-    for trace in figure_data["data"]:
-        figure.add_traces(trace)
-    figure.update_layout(final_layout)
-
-    return figure
+    return new_figure(figure_data["data"], final_layout)
 
+@cached_figure
 def prr_f_PowerDelta(
     df,
     TimeDelta,
     SamePayload,
     TransPair,
     ModesToShow,
-    DataPath=Path('data_preprocessed'),
+    DataPath=None,
     showMarkers=False,
-    showCI=True
+    showCI=True,
+    confidence=75,
+    ci_method='thompson',
+    powerBin=None
     ):
 
+    # The 'min' binning (see `power_delta_bin`) selects the power deltas
+    # of the time delta plots: the power deltas are not binned here
+    if powerBin == 'min':
+        powerBin = 0
+
     # Get the figure data
     figure_data = __prep_PowerDelta_plot__(
         df,
@@ -249,17 +352,21 @@ def prr_f_PowerDelta(
         SamePayload,
         TransPair,
         ModesToShow,
-        DataPath,
         showMarkers=showMarkers,
-        showCI=showCI
+        showCI=showCI,
+        confidence=confidence,
+        ci_method=ci_method,
+        powerBin=powerBin
         )
 
     if figure_data is None:
         return
 
     # Customize the layout
-    final_layout = figure_data["layout"].copy()
+    final_layout = figure_data["layout"]
     final_layout["title"]["text"] = ('PRR = f(Power Delta) <br> with Time Delta = %i ticks' % TimeDelta)
+    if powerBin:
+        final_layout["title"]["text"] += (' (%g dB bins)' % powerBin)
     final_layout["xaxis"]["title"]["text"] = ('Estimated Power Delta at the receiver [dB]')
     final_layout["xaxis"]["range"] = [-17,17]
     final_layout["yaxis"]["range"] = [-3,103]
@@ -267,20 +374,17 @@ def prr_f_PowerDelta(
     final_layout["margin"] = {'t':150}
 
     # Generate the figure
-    figure = go.Figure()
-    for trace in figure_data["data"]:
-        figure.add_traces(trace)
-    figure.update_layout(final_layout)
-
-    return figure
+    return new_figure(figure_data["data"], final_layout)
 
 
+@cached_figure
 def prr_3d(
     df,
     SamePayload,
     TransPair,
     ModesToShow,
-    DataPath=Path('data_preprocessed')
+    DataPath=None,
+    pointBudget=pointBudget3d
     ):
 
     # Get the figure data
@@ -289,14 +393,14 @@ def prr_3d(
         SamePayload,
         TransPair,
         ModesToShow,
-        DataPath
+        pointBudget=pointBudget
         )
 
     if figure_data is None:
         return
 
     # Customize the layout
-    final_layout = figure_data["layout"].copy()
+    final_layout = figure_data["layout"]
     final_layout["title"]["text"] = ''
     final_layout["scene"] = dict(
         xaxis = {
@@ -318,12 +422,7 @@ def prr_3d(
     final_layout["margin"] = {'t':0}
 
     # Generate the figure
-    figure = go.Figure()
-    for trace in figure_data["data"]:
-        figure.add_traces(trace)
-    figure.update_layout(final_layout)
-
-    return figure
+    return new_figure(figure_data["data"], final_layout)
 
 
 def __prep_TimeDelta_plot__(
@@ -332,124 +431,45 @@ def __prep_TimeDelta_plot__(
     SamePayload,
     TransPair,
     ModesToShow,
-    DataPath,
     showMarkers=False,
     showCI=True,
     showTimeThreshold=False,
+    confidence=75,
+    ci_method='thompson',
+    powerBin=None,
     ):
 
-    # Filter the data to plot
-    filter = (
-        (df['SamePayload'] == SamePayload) &
-        (df["PowerDelta"] == PowerDelta)
-    )
-    if TransPair != 'all':
-        filter = filter & (df['TransPair'] == TransPair)
-    filtered_df = df.where(filter).dropna()
+    # Data to plot
+    cube = get_cube(df)
 
     # Initialize the list of traces to plot
     traces = []
-    layout = base_layout.copy()
+    layout = copy.deepcopy(base_layout)
     AnnotList = []
 
-    # Load the median and CI data
-    file_path = DataPath / Parameters['TransPair'][TransPair]['path'] / Parameters['SamePayload'][SamePayload]['path']
-    file_name = 'TimeDeltaTraces_%s_%s_(%i).csv' % (TransPair,SamePayload,PowerDelta)
-    try:
-        df_median = pd.read_csv(file_path / file_name)
-    except FileNotFoundError:
-        print("[ERROR] Use the 'DataPath' argument to indicate the path to your time delta traces.")
-        print("\tAssumed Path(\'data_preprocessed\') by default but nothing found there...")
-        return
-
     # Loop through the modes
     for mode in ModesToShow:
 
-        # Filter specific mode data
-        mode_filter = (filtered_df["Mode"] == Modes[mode]['id'])
-        mode_df = filtered_df.where(mode_filter).dropna()
-        df_median_mode = df_median[["TimeDelta", 'median_'+mode, 'LB_'+mode, 'UB_'+mode]].dropna()
-
-        # Prepare data to plot
-        if len(mode_df) > 0:
-            # Extract all data points
-            x_data = mode_df["TimeDelta"].to_list()
-            y_data = mode_df["PRR"].to_list()
-
-            # Extract median data
-            x_median = df_median_mode["TimeDelta"].to_list()
-            y_median = df_median_mode['median_'+mode].to_list()
-
-            # Extract CI data
-            y_LB = df_median_mode['LB_'+mode].to_list()
-            y_UB = df_median_mode['UB_'+mode].to_list()
-
-            # Prepare the trace for the CI area
-            x_CI = x_median + x_median[::-1]
-            y_CI = y_LB + y_UB[::-1]
-
+        # Slice specific mode data
+        if not powerBin:
+            points = get_cube_points(cube, TransPair, SamePayload,
+                Modes[mode]['id'], PowerDelta=PowerDelta)
+            trace = get_cube_trace(cube, TransPair, SamePayload,
+                Modes[mode]['id'], 'TimeDelta', PowerDelta, confidence, ci_method)
         else:
-            # Force displaying the trace, even if empty
-            x_data = [np.nan]
-            y_data = [np.nan]
-            x_median = [np.nan]
-            y_median = [np.nan]
-            y_LB = [np.nan]
-            y_UB = [np.nan]
-            x_CI = [np.nan]
-            y_CI = [np.nan]
+            # Runs binned by power delta before rounding
+            ranges = power_delta_bin(PowerDelta, powerBin)
+            points = get_delta_points(cube, TransPair, SamePayload,
+                Modes[mode]['id'], ranges=ranges)
+            trace = get_delta_trace(cube, TransPair, SamePayload,
+                Modes[mode]['id'], ranges, confidence, ci_method)
 
-        if showMarkers:
-            # Plot raw data
-            scatter = dict(
-                x=x_data,
-                y=y_data,
-                mode='markers',
-                marker={
-                    'color':Modes[mode]['color'],
-                    'size':markerSize
-                },
-                showlegend=False,
-                legendgroup=Modes[mode]['id'],
-                name=Modes[mode]['label'],
-                hoverinfo='skip',
-                opacity=markerOpacity,
-            )
-            traces.append(scatter)
-
-        # Plot median line
-        median_line = dict(
-            x=x_median,
-            y=y_median,
-            mode='lines',
-            line={'color':Modes[mode]['color']},
-            showlegend=True,
-            legendgroup=Modes[mode]['id'],
-            name=Modes[mode]['label']+' median',
-        )
-        traces.append(median_line)
-
-        if showCI:
-            CI = dict(
-                x=x_CI,
-                y=y_CI,
-                mode='lines',
-                line={
-                    'color':Modes[mode]['color'],
-                    'width':0
-                },
-                showlegend=False,
-                legendgroup=Modes[mode]['id'],
-                name=Modes[mode]['label']+' CI',
-                fill='toself',
-                hoverinfo='skip',
-                opacity=CI_opacity,
-            )
-            traces.append(CI)
+        # Prepare the traces to plot
+        traces += __TimeDelta_traces__(mode, points, trace, showMarkers, showCI)
 
         # Add annotations
         if showTimeThreshold:
-            left_bound = go.layout.Annotation(
+            left_bound = dict(
                     # label position
                     axref="x",
                     ayref="y",
@@ -469,7 +489,7 @@ def __prep_TimeDelta_plot__(
                 )
             AnnotList.append(left_bound)
 
-            right_bound = go.layout.Annotation(
+            right_bound = dict(
                     # label position
                     axref="x",
                     ayref="y",
@@ -490,7 +510,8 @@ def __prep_TimeDelta_plot__(
             AnnotList.append(right_bound)
 
     # Add annotations to the layout
-    layout['annotations'] = AnnotList
+    if AnnotList:
+        layout['annotations'] = AnnotList
 
     return {
         'data': traces,
@@ -498,6 +519,169 @@ def __prep_TimeDelta_plot__(
         }
 
 
+def __prep_TimeDelta_matrix__(
+    df,
+    PowerDeltaList,
+    SamePayload,
+    TransPair,
+    ModesToShow,
+    showMarkers=False,
+    showCI=True,
+    confidence=75,
+    ci_method='thompson'
+    ):
+    '''
+    Prepare the traces of the time delta plots of all cells of the
+    matrix plot (one row per power delta, one column per mode), as a
+    list of lists (row, column) of traces.
+
+    The data of each row are sliced once, for all modes.
+    '''
+
+    # Data to plot
+    cube = get_cube(df)
+    ModeIds = cube['axes']['Mode'].tolist()
+
+    cells = []
+    for PowerDelta in PowerDeltaList:
+
+        # Slice the data of all modes
+        points = get_cube_points(cube, TransPair, SamePayload, None,
+            PowerDelta=PowerDelta)
+        trace = get_cube_trace(cube, TransPair, SamePayload, None,
+            'TimeDelta', PowerDelta, confidence, ci_method)
+
+        # Split them per mode
+        row = []
+        for mode in ModesToShow:
+            selected = points['Mode'] == Modes[mode]['id']
+            mode_points = {name: values[selected] for name, values in points.items()}
+            mode_trace = None
+            if trace is not None:
+                k = ModeIds.index(Modes[mode]['id'])
+                mode_trace = {'x': trace['x']}
+                for name in ['median', 'LB', 'UB']:
+                    mode_trace[name] = trace[name][k]
+            row.append(__TimeDelta_traces__(
+                mode, mode_points, mode_trace, showMarkers, showCI))
+        cells.append(row)
+
+    return cells
+
+def __TimeDelta_traces__(mode, points, trace, showMarkers=False, showCI=True):
+    '''
+    Traces of mode `mode` in the time delta plot, from its data points
+    and median trace (see `get_cube_points` and `get_cube_trace`).
+    '''
+
+    traces = []
+
+    # Prepare data to plot
+    if len(points['PRR']) > 0:
+        # Extract all data points
+        x_data = points['TimeDelta'].tolist()
+        y_data = points['PRR'].tolist()
+
+        # Keep the points where the median and CI are defined
+        valid = ~(
+            np.isnan(trace['median']) |
+            np.isnan(trace['LB']) |
+            np.isnan(trace['UB']))
+
+        # Extract median data
+        x_median = trace['x'][valid].tolist()
+        y_median = trace['median'][valid].tolist()
+
+        # Extract CI data
+        y_LB = trace['LB'][valid].tolist()
+        y_UB = trace['UB'][valid].tolist()
+
+        # Prepare the trace for the CI area
+        x_CI = x_median + x_median[::-1]
+        y_CI = y_LB + y_UB[::-1]
+
+    else:
+        # Force displaying the trace, even if empty
+        x_data = [np.nan]
+        y_data = [np.nan]
+        x_median = [np.nan]
+        y_median = [np.nan]
+        y_LB = [np.nan]
+        y_UB = [np.nan]
+        x_CI = [np.nan]
+        y_CI = [np.nan]
+
+    if showMarkers:
+        # Plot raw data
+        traces.append(__markers_trace__(mode, x_data, y_data))
+
+    # Plot median line
+    median_line = dict(
+        x=x_median,
+        y=y_median,
+        mode='lines',
+        line={'color':Modes[mode]['color']},
+        showlegend=True,
+        legendgroup=str(Modes[mode]['id']),
+        name=Modes[mode]['label']+' median',
+    )
+    traces.append(median_line)
+
+    if showCI:
+        CI = dict(
+            x=x_CI,
+            y=y_CI,
+            mode='lines',
+            line={
+                'color':Modes[mode]['color'],
+                'width':0
+            },
+            showlegend=False,
+            legendgroup=str(Modes[mode]['id']),
+            name=Modes[mode]['label']+' CI',
+            fill='toself',
+            hoverinfo='skip',
+            opacity=CI_opacity,
+        )
+        traces.append(CI)
+
+    return traces
+
+def __markers_trace__(mode, x_data, y_data):
+    '''
+    Trace of the individual run data of mode `mode`.
+
+    Runs with the same (x, PRR) values are collapsed into a single marker,
+    whose area grows with the number of runs (up to `markerSizeMax`).
+    The trace is rendered with WebGL ('scattergl') above `webglThreshold`
+    markers.
+    '''
+    size = markerSize
+    x = np.asarray(x_data, dtype='float64')
+    y = np.asarray(y_data, dtype='float64')
+    if len(x) > 0 and not (np.isnan(x).any() or np.isnan(y).any()):
+        order, starts, counts = __group_rows__([x, y])
+        x_data = x[order][starts].tolist()
+        y_data = y[order][starts].tolist()
+        if (counts > 1).any():
+            size = np.minimum(markerSize * np.sqrt(counts), markerSizeMax).tolist()
+
+    return dict(
+        type='scattergl' if len(x_data) > webglThreshold else 'scatter',
+        x=x_data,
+        y=y_data,
+        mode='markers',
+        marker={
+            'color':Modes[mode]['color'],
+            'size':size
+        },
+        showlegend=False,
+        legendgroup=str(Modes[mode]['id']),
+        name=Modes[mode]['label'],
+        hoverinfo='skip',
+        opacity=markerOpacity,
+    )
+
 # ===========================================
 def __prep_PowerDelta_plot__(
     df,
@@ -505,54 +689,54 @@ def __prep_PowerDelta_plot__(
     SamePayload,
     TransPair,
     ModesToShow,
-    DataPath,
     showMarkers=False,
-    showCI=True
+    showCI=True,
+    confidence=75,
+    ci_method='thompson',
+    powerBin=None
     ):
 
-    # Filter the data to plot
-    filter = (
-        (df['SamePayload'] == SamePayload) &
-        (df["TimeDelta"] == TimeDelta)
-    )
-    if TransPair != 'all':
-        filter = filter & (df['TransPair'] == TransPair)
-    filtered_df = df.where(filter).dropna()
+    # Data to plot
+    cube = get_cube(df)
 
     # Initialize the list of traces to plot
     traces = []
 
-    # Load the median and CI data
-    file_path = DataPath / Parameters['TransPair'][TransPair]['path'] / Parameters['SamePayload'][SamePayload]['path']
-    file_name = 'PowerDeltaTraces_%s_%s_(%i).csv' % (TransPair,SamePayload,TimeDelta)
-    try:
-        df_median = pd.read_csv(file_path / file_name)
-    except FileNotFoundError:
-        print("[ERROR] Use the 'DataPath' argument to indicate the path to your power delta traces.")
-        print("\tAssumed Path(\'data_preprocessed\') by default but nothing found there...")
-        return
-
     # Loop through the modes
     for mode in ModesToShow:
 
-        # Filter specific mode data
-        mode_filter = (filtered_df["Mode"] == Modes[mode]['id'])
-        mode_df = filtered_df.where(mode_filter).dropna()
-        df_median_mode = df_median[["PowerDelta", 'median_'+mode, 'LB_'+mode, 'UB_'+mode]].dropna()
+        # Slice specific mode data
+        if not powerBin:
+            points = get_cube_points(cube, TransPair, SamePayload,
+                Modes[mode]['id'], TimeDelta=TimeDelta)
+            trace = get_cube_trace(cube, TransPair, SamePayload,
+                Modes[mode]['id'], 'PowerDelta', TimeDelta, confidence, ci_method)
+        else:
+            # Runs binned by power delta (of `powerBin` dB) before rounding
+            points = get_delta_points(cube, TransPair, SamePayload,
+                Modes[mode]['id'], TimeDelta=TimeDelta)
+            trace = get_binned_trace(cube, TransPair, SamePayload,
+                Modes[mode]['id'], TimeDelta, powerBin, confidence, ci_method)
 
         # Prepare data to plot
-        if len(mode_df) > 0:
+        if len(points['PRR']) > 0:
             # Extract all data points
-            x_data = mode_df["PowerDelta"].to_list()
-            y_data = mode_df["PRR"].to_list()
+            x_data = points['PowerDelta'].tolist()
+            y_data = points['PRR'].tolist()
+
+            # Keep the points where the median and CI are defined
+            valid = ~(
+                np.isnan(trace['median']) |
+                np.isnan(trace['LB']) |
+                np.isnan(trace['UB']))
 
             # Extract median data
-            x_median = df_median_mode["PowerDelta"].to_list()
-            y_median = df_median_mode['median_'+mode].to_list()
+            x_median = trace['x'][valid].tolist()
+            y_median = trace['median'][valid].tolist()
 
             # Extract CI data
-            y_LB = df_median_mode['LB_'+mode].to_list()
-            y_UB = df_median_mode['UB_'+mode].to_list()
+            y_LB = trace['LB'][valid].tolist()
+            y_UB = trace['UB'][valid].tolist()
 
             # Prepare the trace for the CI area
             x_CI = x_median + x_median[::-1]
@@ -571,21 +755,7 @@ def __prep_PowerDelta_plot__(
 
         # Plot raw data
         if showMarkers:
-            scatter = dict(
-                x=x_data,
-                y=y_data,
-                mode='markers',
-                marker={
-                    'color':Modes[mode]['color'],
-                    'size':markerSize
-                },
-                showlegend=False,
-                legendgroup=Modes[mode]['id'],
-                name=Modes[mode]['label'],
-                hoverinfo='skip',
-                opacity=markerOpacity,
-            )
-            traces.append(scatter)
+            traces.append(__markers_trace__(mode, x_data, y_data))
 
         # Plot median line
         median_line = dict(
@@ -594,7 +764,7 @@ def __prep_PowerDelta_plot__(
             mode='lines',
             line={'color':Modes[mode]['color']},
             showlegend=True,
-            legendgroup=Modes[mode]['id'],
+            legendgroup=str(Modes[mode]['id']),
             name=Modes[mode]['label'],
         )
         traces.append(median_line)
@@ -609,7 +779,7 @@ def __prep_PowerDelta_plot__(
                     'width':0
                 },
                 showlegend=False,
-                legendgroup=Modes[mode]['id'],
+                legendgroup=str(Modes[mode]['id']),
                 name=Modes[mode]['label']+' CI',
                 fill='toself',
                 hoverinfo='skip',
@@ -619,7 +789,7 @@ def __prep_PowerDelta_plot__(
 
     return {
         'data': traces,
-        'layout': base_layout.copy()
+        'layout': copy.deepcopy(base_layout)
         }
 
 # ===========================================
@@ -628,33 +798,43 @@ def __prep_3d_plot__(
     SamePayload,
     TransPair,
     ModesToShow,
-    DataPath
+    pointBudget=None
     ):
-
-    # Filter the data to plot
-    filter = (
-        (df['SamePayload'] == SamePayload)
-    )
-    if TransPair != 'all':
-        filter = filter & (df['TransPair'] == TransPair)
-    filtered_df = df.where(filter).dropna()
+    '''
+    With a `pointBudget`, the points are aggregated into voxels of
+    increasing sizes (see `voxelSizes3d`), until the total number of
+    points fits in the budget; the markers are then sized by the number
+    of runs they aggregate. If even the largest voxels do not fit, a
+    deterministic sample of them is shown.
+    Without budget (None), all runs are shown.
+    '''
+
+    # Data to plot
+    cube = get_cube(df)
 
     # Initialize the list of traces to plot
     traces = []
 
-    # Loop through the modes
-    for mode in ModesToShow:
+    # Slice specific mode data
+    clouds = [
+        get_cube_points(cube, TransPair, SamePayload, Modes[mode]['id'])
+        for mode in ModesToShow]
+    if pointBudget is not None:
+        clouds = __level_of_detail__(clouds, pointBudget)
 
-        # Filter specific mode data
-        mode_filter = (filtered_df["Mode"] == Modes[mode]['id'])
-        mode_df = filtered_df.where(mode_filter).dropna()
+    # Loop through the modes
+    for mode, points in zip(ModesToShow, clouds):
 
         # Prepare data to plot
-        if len(mode_df) > 0:
+        size = markerSize
+        if len(points['PRR']) > 0:
             # Extract all data points
-            x_data = mode_df["PowerDelta"].to_list()
-            y_data = mode_df["TimeDelta"].to_list()
-            z_data = mode_df["PRR"].to_list()
+            x_data = points["PowerDelta"].tolist()
+            y_data = points["TimeDelta"].tolist()
+            z_data = points["PRR"].tolist()
+            if 'count' in points and (points['count'] > 1).any():
+                size = np.minimum(
+                    markerSize * np.sqrt(points['count']), markerSizeMax3d).tolist()
 
         else:
             # Force displaying the trace, even if empty
@@ -671,10 +851,10 @@ def __prep_3d_plot__(
             mode='markers',
             marker={
                 'color':Modes[mode]['color'],
-                'size':markerSize
+                'size':size
             },
             showlegend=True,
-            legendgroup=Modes[mode]['id'],
+            legendgroup=str(Modes[mode]['id']),
             name=Modes[mode]['label'],
             hoverinfo='skip',
             opacity=markerOpacity,
@@ -683,5 +863,67 @@ def __prep_3d_plot__(
 
     return {
         'data': traces,
-        'layout': base_layout.copy()
+        'layout': copy.deepcopy(base_layout)
         }
+
+def __level_of_detail__(clouds, pointBudget):
+    '''
+    Aggregate the point `clouds` (see `get_cube_points`) into voxels of
+    increasing sizes until they fit in `pointBudget` points in total,
+    sampling the largest voxels deterministically otherwise.
+    '''
+    for PowerDeltaSize, PRRSize in voxelSizes3d:
+        voxels = [__voxels__(points, PowerDeltaSize, PRRSize) for points in clouds]
+        total = sum(len(points['count']) for points in voxels)
+        if total <= pointBudget:
+            return voxels
+
+    # Share the budget between the clouds
+    sampled = []
+    for points in voxels:
+        n = len(points['count'])
+        keep = np.sort(np.random.RandomState(0).choice(
+            n, int(pointBudget * n / total), replace=False))
+        sampled.append({name: values[keep] for name, values in points.items()})
+    return sampled
+
+def __voxels__(points, PowerDeltaSize, PRRSize):
+    '''
+    Aggregate the points into voxels of `PowerDeltaSize` dB by time delta
+    by `PRRSize` %; each voxel is located at the mean of its points.
+    Returns the same arrays as `get_cube_points`, plus their 'count'.
+    '''
+    coords = [
+        np.asarray(points[name], dtype='float64')
+        for name in ['PowerDelta', 'TimeDelta', 'PRR']]
+    # Voxel of each point
+    keys = [
+        np.floor(values / size + 0.5) if size else values
+        for values, size in zip(coords, [PowerDeltaSize, 0, PRRSize])]
+    order, starts, counts = __group_rows__(keys)
+    if len(counts) == 0:
+        means = coords
+    else:
+        means = [np.add.reduceat(values[order], starts) / counts for values in coords]
+    return {
+        'PowerDelta': means[0],
+        'TimeDelta': means[1],
+        'PRR': means[2],
+        'count': counts,
+    }
+
+def __group_rows__(columns):
+    '''
+    Sort the rows of `columns` (arrays of the same length) and group the
+    equal ones. Returns the sort order, and the start (in sorted order)
+    and number of rows of each group.
+    '''
+    order = np.lexsort(columns[::-1])
+    new = np.zeros(len(order), dtype=bool)
+    if len(order):
+        new[0] = True
+        for values in columns:
+            values = values[order]
+            new[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(new)
+    return order, starts, np.diff(np.append(starts, len(order)))
@@ -1,14 +1,154 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import json
 import pandas as pd
 import numpy as np
 
-from src.helpers import Modes, Parameters
-from src.stats import ThompsonCI_twosided
+from src.helpers import Modes, Parameters, file_hash
+from src.stats import ThompsonCI_twosided_batch, BootstrapCI_twosided_batch
 
 prr_file = 'prr.csv'
 rssi_file = 'rssi.csv'
+all_csv_file = 'data_preprocessed_all.csv'
+all_snapshot_file = 'data_preprocessed_all.npz'
+manifest_file = 'manifest.json'
+
+# Power delta values (x-axis) of the traces as a function of the power delta
+trace_PowerDelta_values = np.arange(-16, 17)
+
+# Compact column types of the aggregated run table, applied when loading
+# the table (see `compact_run_table`) and used to store the binary snapshot
+run_table_dtypes = dict(
+    LocalExpCount   = 'uint16',
+    TxPowerA        = 'int8',
+    TxPowerB        = 'int8',
+    Mode            = 'uint8',
+    TimeDelta       = 'int16',
+    RxCount         = 'uint8',
+    TxCount         = 'uint8',
+    RssiA           = 'float32',
+    RssiB           = 'float32',
+    PRR             = 'float32',
+    PowerDelta      = 'float32',
+    DateTime        = 'datetime64[ns]',
+    SamePayload     = 'uint8',
+    TransPair       = 'category',
+)
+
+def compact_run_table(df):
+    '''
+    Convert the columns of the aggregated run table to the compact
+    types given in `run_table_dtypes`. Integer columns whose values
+    do not fit the compact type are kept as is.
+    '''
+    dtypes = {}
+    for column, dtype in run_table_dtypes.items():
+        if dtype != 'category' and np.dtype(dtype).kind in 'iu':
+            values = df[column].values
+            info = np.iinfo(dtype)
+            if len(values) and (values.min() < info.min or values.max() > info.max):
+                print('[WARNING] %s values do not fit in %s; kept as %s.' % (
+                    column, dtype, values.dtype))
+                continue
+        dtypes[column] = dtype
+    return df.astype(dtypes)
+
+def memory_report(df):
+    '''
+    Compare the memory footprint of the aggregated run table using the
+    compact types (see `compact_run_table`) and the default types, i.e.,
+    64-bit numbers and Python strings, as obtained when parsing the csv.
+
+    Returns a DataFrame with the bytes used per column.
+    '''
+    compact = compact_run_table(df)
+    default = compact.astype({
+        column: {'i': 'int64', 'u': 'int64', 'f': 'float64'}.get(
+            compact[column].dtype.kind, object)
+        for column in compact.columns
+        if compact[column].dtype.kind != 'M'
+    })
+    report = pd.DataFrame({
+        'default': default.memory_usage(deep=True),
+        'compact': compact.memory_usage(deep=True),
+    })
+    report.loc['Total'] = report.sum()
+    report['ratio'] = report['default'] / report['compact']
+    print('Run table: %.1f MB with the default types, %.1f MB compact (%.1fx)' % (
+        report.loc['Total', 'default'] / 1e6,
+        report.loc['Total', 'compact'] / 1e6,
+        report.loc['Total', 'ratio']))
+    return report
+
+def save_snapshot(df, file_path):
+    '''
+    Save the aggregated run table as a (uncompressed) NumPy .npz archive,
+    one array per column with the types given in `run_table_dtypes`
+    (categories are stored as strings).
+    '''
+    arrays = {'GlobalExpCount': df.index.values.astype('int64')}
+    for column, dtype in run_table_dtypes.items():
+        if dtype == 'category':
+            dtype = 'U'
+        arrays[column] = np.asarray(df[column].values).astype(dtype)
+    np.savez(file_path, **arrays)
+
+def load_snapshot(file_path):
+    '''
+    Load the aggregated run table saved with `save_snapshot`.
+    '''
+    with np.load(file_path) as arrays:
+        columns = {
+            column: arrays[column] for column in run_table_dtypes
+        }
+        index = pd.Index(arrays['GlobalExpCount'], name='GlobalExpCount')
+    return compact_run_table(pd.DataFrame(columns, index=index))
+
+def __newest_run_file__(output_path):
+    '''
+    Return the latest modification time of the per-run preprocessed files
+    (`prr.csv` and `medianRSSI.csv`), or 0 if there are none.
+    '''
+    mtimes = [
+        f.stat().st_mtime
+        for name in [prr_file, 'medianRSSI.csv']
+        for f in output_path.glob('*/*/*/' + name)
+    ]
+    return max(mtimes, default=0)
+
+def load_preprocessed_data(output_path=Path('data_preprocessed')):
+    '''
+    Load the aggregated run table, preferentially from the binary snapshot,
+    with the csv file as fallback. Files older than any of the per-run
+    preprocessed files are considered stale and ignored.
+
+    Returns None if no up-to-date file is found.
+    '''
+    newest = __newest_run_file__(output_path)
+
+    snapshot_path = output_path / all_snapshot_file
+    if snapshot_path.is_file() and snapshot_path.stat().st_mtime >= newest:
+        return load_snapshot(snapshot_path)
+
+    csv_path = output_path / all_csv_file
+    if csv_path.is_file() and csv_path.stat().st_mtime >= newest:
+        df = pd.read_csv(csv_path, parse_dates=['DateTime'])
+        df.set_index('GlobalExpCount', inplace=True)
+        df = compact_run_table(df)
+        # Create the snapshot for the next load
+        save_snapshot(df, snapshot_path)
+        return df
+
+    return None
 
-def parse_run_rssi(pair,data,datetime,force_computation=''):
+def parse_run_rssi(pair,data,datetime,force_computation='',percentiles=(),chunksize=100000):
+    '''
+    Compute (or load) the median RSSI of each transmitter per setting.
+    The raw file is streamed by chunks of `chunksize` rows (see
+    `__reduce_rssi__`); the requested extra `percentiles` (e.g. [10, 90])
+    are returned as additional columns when computed, but not saved.
+    '''
 
     data_path = Path('data_raw')
     output_path = Path('data_preprocessed')
@@ -30,28 +170,97 @@ def parse_run_rssi(pair,data,datetime,force_computation=''):
         output_path.mkdir(parents=True, exist_ok=True)
         print('Created path: %s' % str(output_path))
 
-    # Load RSSI data
-    # -> skip leading and trailing space in column names
-    rssi_df = pd.read_csv(str(data_path / rssi_file))
+    # Aggregate and compute the median (and other percentiles)
+    rssi_medians = __reduce_rssi__(
+        data_path / rssi_file, [50] + list(percentiles), chunksize)
+    rssi_medians = rssi_medians.rename(columns={
+        "p50RSSI": "medianRSSI",
+    })
 
-    # Create a filter for missing RSSI measurements
-    filter = rssi_df["RSSI"]!="NONE"
+    # Save as csv
+    rssi_medians[["Mode","Transmitter","TxPower","medianRSSI"]].to_csv(
+        output_path / 'medianRSSI.csv', index=False)
 
-    # Filter out the missing measurements and convert as numeric
-    rssi_df = rssi_df.where(filter).dropna().astype('int32')
+    return rssi_medians
 
-    # Rename columns
-    rssi_df = rssi_df.rename(columns={
-        "RSSI": "medianRSSI",
-    })
+def __reduce_rssi__(file_path, percentiles, chunksize=100000):
+    '''
+    Stream the RSSI measurements by chunks and fold them into a histogram
+    per (Mode, Transmitter, TxPower) setting, i.e., the count of each RSSI
+    value. The memory footprint is thus bounded by the number of distinct
+    RSSI values per setting, regardless of the length of the file.
 
-    # Aggregate and compute the median
-    rssi_medians = rssi_df.groupby(["Mode","Transmitter","TxPower"]).medianRSSI.agg('median')
+    The exact percentiles are then computed from the histograms (with linear
+    interpolation between samples, as `np.percentile`).
 
-    # Save as csv
-    rssi_medians.to_csv(output_path / 'medianRSSI.csv')
+    Returns a DataFrame with the columns Mode, Transmitter, TxPower,
+    and one column `p<percentile>RSSI` per requested percentile.
+    '''
+    keys = ["Mode","Transmitter","TxPower"]
+
+    # Count the RSSI values per setting
+    counts = None
+    for chunk in pd.read_csv(
+        file_path, usecols=keys+["RSSI"], dtype={"RSSI": str}, chunksize=chunksize):
+
+        # Filter out the missing measurements and convert as numeric
+        chunk = chunk[chunk["RSSI"] != "NONE"].dropna().astype('int32')
+
+        chunk_counts = chunk.groupby(keys+["RSSI"]).size()
+        if counts is None:
+            counts = chunk_counts
+        else:
+            counts = counts.add(chunk_counts, fill_value=0)
+
+    columns = ['p%gRSSI' % percentile for percentile in percentiles]
+    if counts is None or len(counts) == 0:
+        return pd.DataFrame(columns=keys+columns)
+
+    # Sorted histograms, one after the other
+    counts = counts.sort_index()
+    hist_df = counts.index.to_frame(index=False)
+    rssi = hist_df["RSSI"].values.astype('float64')
+    cumcount = np.cumsum(counts.values.astype('int64'))
+
+    # Histogram boundaries
+    new_group = np.zeros(len(hist_df), dtype=bool)
+    new_group[:1] = True
+    for key in keys:
+        values = hist_df[key].values
+        new_group[1:] |= (values[1:] != values[:-1])
+    starts = np.flatnonzero(new_group)
+    ends = np.append(starts[1:], len(hist_df))
+    before = np.append(0, cumcount)[starts]
+    n_samples = cumcount[ends - 1] - before
+
+    result = hist_df.iloc[starts][keys].reset_index(drop=True)
+    for percentile, column in zip(percentiles, columns):
+        # Rank of the samples around the percentile, within each setting
+        rank = (n_samples - 1) * percentile / 100
+        rank_lo = np.floor(rank).astype('int64')
+        rank_hi = np.ceil(rank).astype('int64')
+        # Corresponding RSSI values, found in the cumulated counts
+        value_lo = rssi[np.searchsorted(cumcount, before + rank_lo, side='right')]
+        value_hi = rssi[np.searchsorted(cumcount, before + rank_hi, side='right')]
+        result[column] = value_lo + (rank - rank_lo) * (value_hi - value_lo)
 
-    return rssi_medians
+    return result
+
+def __lookup_rssi__(rssi_df, Mode, Transmitter, TxPower):
+    '''
+    Gather the median RSSI of every (Mode, Transmitter, TxPower) setting
+    from the medianRSSI DataFrame, in one pass over the rows.
+    Returns an array of floats, with NaN for settings without measurement.
+    '''
+    keys = ["Mode","Transmitter","TxPower"]
+    lookup = rssi_df.set_index(keys)['medianRSSI'].astype('float64')
+    # Keep the first measurement only, should a setting appear twice
+    lookup = lookup[~lookup.index.duplicated()]
+
+    index = pd.MultiIndex.from_arrays(
+        [Mode, np.full(len(Mode), Transmitter), TxPower],
+        names=keys)
+    return lookup.reindex(index).values
 
 def parse_run_prr(pair,data,datetime,force_computation=''):
 
@@ -78,50 +287,10 @@ def parse_run_prr(pair,data,datetime,force_computation=''):
     rssi_df = pd.read_csv(output_path / 'medianRSSI.csv')
 
     # Fill-in the values based on the RSSI DataFrame
-    TxPowerA = df.TxPowerA.unique()
-    TxPowerB = df.TxPowerB.unique()
-    Mode = df.Mode.unique()
-
-    for M in Mode:
-
-        # Transmitter A
-        for Tx in TxPowerA:
-            # Get the RSSI measurement
-            RssiA = rssi_df.loc[
-                (rssi_df['Mode'] == M) &
-                (rssi_df['TxPower'] == Tx) &
-                (rssi_df['Transmitter'] == 0)
-            ]
-            # If no value, set as NaN
-            if len(RssiA) == 0:
-                RssiA_value = np.nan
-            else:
-                RssiA_value = RssiA.medianRSSI.values[0]
-            # Place the value in the global DataFrame
-            df.loc[
-                (df['Mode'] == M) &
-                (df['TxPowerA'] == Tx), ("RssiA")
-            ] = RssiA_value
-
-
-        # Get RSSI measurement for Transmitter B
-        for Tx in TxPowerB:
-            # Get the RSSI measurement
-            RssiB = rssi_df.loc[
-                (rssi_df['Mode'] == M) &
-                (rssi_df['TxPower'] == Tx) &
-                (rssi_df['Transmitter'] == 1)
-            ]
-            # If no value, set as NaN
-            if len(RssiB) == 0:
-                RssiB_value = np.nan
-            else:
-                RssiB_value = RssiB.medianRSSI.values[0]
-            # Place the value in the global DataFrame
-            df.loc[
-                (df['Mode'] == M) &
-                (df['TxPowerB'] == Tx), ("RssiB")
-            ] = RssiB_value
+    # -> single lookup keyed on (Mode, Transmitter, TxPower);
+    #    settings without RSSI measurement are set as NaN
+    df["RssiA"] = __lookup_rssi__(rssi_df, df['Mode'], 0, df['TxPowerA'])
+    df["RssiB"] = __lookup_rssi__(rssi_df, df['Mode'], 1, df['TxPowerB'])
 
     # Add to the DataFrame
     # + PowerDelta
@@ -151,11 +320,56 @@ def parse_run_prr(pair,data,datetime,force_computation=''):
 
     return df
 
-def parse_all_data(verbose=False, force_computation=''):
+def list_runs(data_path=Path('data_raw')):
+    '''
+    List the runs available in `data_path`, as (pair, data, datetime)
+    directory names, in a deterministic (sorted) order.
+    '''
+    return [
+        (pair.name, data.name, datetime.name)
+        for pair in sorted(x for x in data_path.iterdir() if x.is_dir())
+        for data in sorted(x for x in pair.iterdir() if x.is_dir())
+        for datetime in sorted(x for x in data.iterdir() if x.is_dir())
+    ]
+
+def __parse_run__(run, force_computation='', verbose=False):
+    '''
+    Parse one run (RSSI then PRR); executed in the worker processes
+    of `parse_all_data`.
+    '''
+    pair, data, datetime = run
+    if verbose:
+        print(Path('data_raw') / pair / data / datetime)
+    # Parse RSSI measurements to get the median RSS from both
+    # transmitters at the receiver side
+    parse_run_rssi(pair,data,datetime,force_computation)
+    # Parse PRR measurements, add experiment metadata,
+    # RSS values, and compute the estimated PowerDelta
+    return parse_run_prr(pair,data,datetime,force_computation)
+
+def __map_runs__(function, runs, n_jobs=1, **kwargs):
+    '''
+    Apply `function` to all runs, using a pool of `n_jobs` processes
+    if n_jobs > 1 (n_jobs=None uses all the available cores).
+    The results are returned in the order of `runs`.
+    '''
+    if n_jobs == 1:
+        return [function(run, **kwargs) for run in runs]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(partial(function, **kwargs), runs))
+
+def parse_all_data(verbose=False, force_computation='', n_jobs=1, incremental=False):
     '''
     Compute (or load) the processed data per run,
     including the RSSI estimation and the PRR.
-    Pass `force_computation=True` for recompute from the raw data.
+    Pass `force_computation=True` for recompute from the raw data,
+    or 'aggregate' to only re-aggregate the existing per-run files.
+    Otherwise, the aggregated data are loaded from the binary snapshot
+    (or the csv file), unless outdated compared to the per-run files.
+    With `incremental=True`, the raw files are compared against the
+    manifest of the last ingestion and only new or changed runs are parsed.
+    Runs are processed in parallel using `n_jobs` processes
+    (n_jobs=None uses all the available cores).
 
     Returns a DataFrame with the preprocessed data
     '''
@@ -170,32 +384,35 @@ def parse_all_data(verbose=False, force_computation=''):
 
     if ((force_computation == 'prr') or (force_computation == 'rssi')):
         print('Recomputing preprocessed data...')
+    elif force_computation == 'aggregate':
+        print('Aggregating preprocessed data...')
+        force_computation = ''
+    elif incremental:
+        df, _ = __ingest_incremental__(verbose, n_jobs)
+        return df
     else:
-        try:
-            df = pd.read_csv(output_path / 'data_preprocessed_all.csv')
-            df.set_index('GlobalExpCount', inplace=True)
+        df = load_preprocessed_data(output_path)
+        if df is not None:
             print('Processed data retrieved.')
             return df
-        except FileNotFoundError:
-            print('No existing file found. Computing...')
-
-    # Temporary data structure
-    frames = []
-
-    # Loop through all folders
-    for pair in [x for x in data_path.iterdir() if x.is_dir()]:
-        for data in [x for x in pair.iterdir() if x.is_dir()]:
-            for datetime in [x for x in data.iterdir() if x.is_dir()]:
-                if verbose:
-                    print(datetime)
-                # Parse RSSI measurements to get the median RSS from both
-                # transmitters at the receiver side
-                rssi = parse_run_rssi(pair.name,data.name,datetime.name,force_computation)
-                # Parse PRR measurements, add experiment metadata,
-                # RSS values, and compute the estimated PowerDelta
-                prr  = parse_run_prr(pair.name,data.name,datetime.name,force_computation)
-                # Append all the result to a list
-                frames.append(prr)
+        print('No up-to-date file found. Computing...')
+
+    # Parse all runs; the results are kept in the order of the runs list,
+    # such that the GlobalExpCount does not depend on the parallelization
+    runs = list_runs(data_path)
+    # Runs parsed from the raw files; the others are loaded from their
+    # preprocessed files, which may be outdated
+    from_raw = [
+        run for run in runs
+        if force_computation == 'rssi' or not any(
+            (output_path.joinpath(*run) / f).is_file() for f in ['medianRSSI.csv', prr_file])
+    ]
+    frames = __map_runs__(
+        __parse_run__,
+        runs,
+        n_jobs,
+        force_computation=force_computation,
+        verbose=verbose)
 
     # Concatenate all results as a unique DataFrame,
     # do some formating clean-up and save as .csv
@@ -203,254 +420,518 @@ def parse_all_data(verbose=False, force_computation=''):
     result['GlobalExpCount'] = np.arange(len(result))
     result.set_index('GlobalExpCount', inplace=True)
     result = result.rename(columns={"ExpCount": "LocalExpCount"})
-    result.to_csv(output_path / 'data_preprocessed_all.csv')
+    result.to_csv(output_path / all_csv_file)
+    save_snapshot(result, output_path / all_snapshot_file)
+
+    # Record the state of the raw files for the incremental mode, for the
+    # runs parsed from the raw files only
+    names = set(__run_name__(run) for run in runs)
+    manifest = {
+        name: fingerprint for name, fingerprint in __load_manifest__(output_path).items()
+        if name in names}
+    for run in from_raw:
+        name = __run_name__(run)
+        manifest[name] = __fingerprint_run__(run, manifest.get(name))
+    save_manifest(manifest, output_path)
 
     print('Done.')
 
-    return result
+    return compact_run_table(result)
 
-def clean_raw_data():
+def __load_manifest__(output_path=Path('data_preprocessed')):
     '''
-    + Rename columns
-    + Correct the logging issue for TimeDelta = -100
+    Load the manifest of the last ingestion, mapping each run name to the
+    fingerprint of its raw files. Returns an empty dict if there is none.
+    '''
+    try:
+        with open(output_path / manifest_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(manifest, output_path=Path('data_preprocessed')):
+    with open(output_path / manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def __run_name__(run):
+    return '/'.join(run)
+
+def __run_key__(run):
+    '''
+    Return the (TransPair, SamePayload, DateTime) values identifying
+    the rows of a given run in the aggregated run table.
+    '''
+    pair, data, datetime = run
+    pair_label = [
+        k for k,v in Parameters['TransPair'].items() if v['path'] == pair][0]
+    data_label = [
+        i for i,v in enumerate(Parameters['SamePayload']) if v['path'] == data][0]
+    return (
+        pair_label,
+        data_label,
+        pd.to_datetime(datetime, format='%Y%m%d_%H%M%S'))
+
+def __fingerprint_run__(run, previous=None):
+    '''
+    Return the size, modification time, and content hash of the raw files
+    of a run. The hash of the `previous` fingerprint is reused for files
+    whose size and modification time have not changed (see `file_hash`).
+    '''
+    run_path = Path('data_raw') / run[0] / run[1] / run[2]
+    cache = {str(run_path / name): entry for name, entry in (previous or {}).items()}
+    fingerprint = {}
+    for name in [prr_file, rssi_file]:
+        if file_hash(run_path / name, cache) is None:
+            raise FileNotFoundError(run_path / name)
+        fingerprint[name] = cache[str(run_path / name)]
+    return fingerprint
+
+def __ingest_incremental__(verbose=False, n_jobs=1):
+    '''
+    Update the aggregated run table with the new or changed runs only,
+    as given by comparing the raw files with the ingestion manifest.
+    Runs absent from the manifest (i.e., never ingested from their raw
+    files) are parsed; removed runs are dropped from the table.
+
+    Returns the updated DataFrame, and the rows affected by the update
+    (both the old and the new rows of the changed runs).
+    '''
+    output_path = Path('data_preprocessed')
+
+    df = load_preprocessed_data(output_path)
+    if df is None:
+        df = parse_all_data(verbose, force_computation='rssi', n_jobs=n_jobs)
+        return df, df
+
+    # Split the table per run
+    columns = df.columns
+    groups = {
+        key: frame for key, frame in
+        df.groupby(['TransPair','SamePayload','DateTime'], sort=False, observed=True)
+    }
+
+    # Compare the raw files with the manifest
+    manifest = __load_manifest__(output_path)
+    new_manifest = {}
+    to_parse = []
+    runs = list_runs(Path('data_raw'))
+    for run in runs:
+        name = __run_name__(run)
+        new_manifest[name] = __fingerprint_run__(run, manifest.get(name))
+        changed = name not in manifest or any(
+            new_manifest[name][f]['sha1'] != manifest[name].get(f, {}).get('sha1')
+            for f in new_manifest[name])
+        if changed:
+            to_parse.append(run)
+    removed = set(groups) - set(__run_key__(run) for run in runs)
+
+    if not to_parse and not removed:
+        save_manifest(new_manifest, output_path)
+        print('Processed data up-to-date.')
+        return df, df.iloc[:0]
+
+    print('Parsing %i new or changed run(s)...' % len(to_parse))
+    parsed = __map_runs__(
+        __parse_run__,
+        to_parse,
+        n_jobs,
+        force_computation='rssi',
+        verbose=verbose)
+    parsed = {run: frame for run, frame in zip(to_parse, parsed)}
+
+    # Splice the new runs in the table, keeping the order of the runs list
+    frames = []
+    touched = [groups[key] for key in removed]
+    for run in runs:
+        key = __run_key__(run)
+        if run in parsed:
+            frame = parsed[run].rename(columns={"ExpCount": "LocalExpCount"})
+            frame['DateTime'] = pd.to_datetime(frame['DateTime'])
+            frames.append(frame[columns])
+            touched.append(frame[columns])
+            if key in groups:
+                touched.append(groups[key])
+        else:
+            frames.append(groups[key])
+
+    result = compact_run_table(pd.concat(frames, ignore_index=True))
+    result.index.name = 'GlobalExpCount'
+    result.to_csv(output_path / all_csv_file)
+    save_snapshot(result, output_path / all_snapshot_file)
+    save_manifest(new_manifest, output_path)
+
+    print('Done.')
+
+    return result, pd.concat(touched)
+
+def update_preprocessed_data(verbose=False, n_jobs=1):
+    '''
+    Incrementally update the preprocessed data:
+    + parse the new or changed runs only (see `parse_all_data`)
+    + recompute the traces files affected by these runs only
+
+    Returns a DataFrame with the preprocessed data
+    '''
+    old_TimeDeltaValues = None
+    df = load_preprocessed_data()
+    if df is not None:
+        old_TimeDeltaValues = set(df['TimeDelta'].dropna().unique())
+
+    df, touched = __ingest_incremental__(verbose, n_jobs)
+    if len(touched) == 0:
+        return df
+
+    # Settings affected by the changed runs, for each pair and for all pairs
+    TimeDeltaCells = set()
+    PowerDeltaCells = set()
+    for TransPair, SamePayload, PowerDelta, TimeDelta in zip(
+        touched['TransPair'], touched['SamePayload'],
+        touched['PowerDelta'], touched['TimeDelta']):
+        for pair in [TransPair, 'all']:
+            if not np.isnan(PowerDelta):
+                TimeDeltaCells.add((pair, SamePayload, PowerDelta))
+            PowerDeltaCells.add((pair, SamePayload, TimeDelta))
+
+    # The time delta traces span all time delta values:
+    # if these change, all the files must be updated
+    if old_TimeDeltaValues != set(df['TimeDelta'].dropna().unique()):
+        TimeDeltaCells = None
+
+    computeTraces(
+        df=df,
+        TimeDeltaCells=TimeDeltaCells,
+        PowerDeltaCells=PowerDeltaCells)
+
+    return df
+
+def __clean_run__(run):
+    '''
+    Clean the raw files of one run; executed in the worker processes
+    of `clean_raw_data`.
     '''
     # Data paths
     data_path = Path('data_raw_origin')
     output_path = Path('data_raw')
 
-    for pair in [x for x in data_path.iterdir() if x.is_dir()]:
-        for data in [x for x in pair.iterdir() if x.is_dir()]:
-            for datetime in [x for x in data.iterdir() if x.is_dir()]:
-
-                # Create output directory if it does not exist yet
-                file_path = output_path / pair.name / data.name / datetime.name
-                if not (file_path).is_dir():
-                    file_path.mkdir(parents=True, exist_ok=True)
-                    print('Created path: %s' % str(file_path))
-
-                # ===============
-                # Clean PRR files
-                # ===============
-                df = pd.read_csv(str(datetime / prr_file), sep=r'\s*,\s*', engine='python')
-
-                # Rename columns
-                df = df.rename(columns={
-                    "Experiment Number": "ExpCount",
-                    "TX Power A": "TxPowerA",
-                    "TX Power B": "TxPowerB",
-                    "Time Delta": "TimeDelta",
-                    "Packets Received": "RxCount",
-                    "Packets Transmitted": "TxCount",
-                })
-
-                # Correct a bug in TimeDelta values:
-                # -100' values are written as '100'
-                TimeDelta_current = None
-                for index, row in df.iterrows():
-                    # print(row["Time Delta"])
-                    if ((TimeDelta_current == -120) &
-                        (row["TimeDelta"] == 100)):
-                        row["TimeDelta"] = -100
-                    TimeDelta_current = row["TimeDelta"]
-
-                # Save DataFrame as csv
-                df.to_csv(file_path / 'prr.csv', index=False)
-
-                # ===============
-                # Clean RSSI files
-                # ===============
-                df = pd.read_csv(str(datetime / rssi_file), sep=r'\s*,\s*', engine='python')
-
-                # Rename columns
-                df = df.rename(columns={
-                    "Measurement Number": "MeasureCount",
-                    "TX Power": "TxPower",
-                })
-
-                # Save DataFrame as csv
-                df.to_csv(file_path / 'rssi.csv', index=False)
-
-                # Debug output
-                print('Done: %s', str(datetime))
+    pair, data, datetime = run
+    datetime = data_path / pair / data / datetime
 
-    return
+    # Create output directory if it does not exist yet
+    file_path = output_path / pair / data / datetime.name
+    if not (file_path).is_dir():
+        file_path.mkdir(parents=True, exist_ok=True)
+        print('Created path: %s' % str(file_path))
+
+    # ===============
+    # Clean PRR files
+    # ===============
+    df = __read_raw_csv__(datetime / prr_file)
+
+    # Rename columns
+    df = df.rename(columns={
+        "Experiment Number": "ExpCount",
+        "TX Power A": "TxPowerA",
+        "TX Power B": "TxPowerB",
+        "Time Delta": "TimeDelta",
+        "Packets Received": "RxCount",
+        "Packets Transmitted": "TxCount",
+    })
+
+    # Correct a bug in TimeDelta values:
+    # -100' values are written as '100'
+    # -> identified by the previous value being -120
+    bug = (df["TimeDelta"].shift() == -120) & (df["TimeDelta"] == 100)
+    df.loc[bug, "TimeDelta"] = -100
+    patched = int(bug.sum())
+
+    # Save DataFrame as csv
+    df.to_csv(file_path / 'prr.csv', index=False)
+
+    # ===============
+    # Clean RSSI files
+    # ===============
+    df = __read_raw_csv__(datetime / rssi_file)
+
+    # Rename columns
+    df = df.rename(columns={
+        "Measurement Number": "MeasureCount",
+        "TX Power": "TxPower",
+    })
+
+    # Save DataFrame as csv
+    df.to_csv(file_path / 'rssi.csv', index=False)
+
+    # Debug output
+    print('Done: %s (%i TimeDelta values corrected)' % (str(datetime), patched))
 
-def computeTimeDeltaTraces(all_pairs=False):
+    return patched
+
+def __read_raw_csv__(file_path):
+    '''
+    Read a raw csv file, where values are padded with spaces around the
+    separators, using the (fast) C parser.
+    '''
+    df = pd.read_csv(file_path, skipinitialspace=True)
+    df.columns = df.columns.str.strip()
+
+    # Trailing spaces prevent the conversion of numeric columns
+    for column in df.select_dtypes(exclude='number').columns:
+        values = df[column].str.strip()
+        try:
+            df[column] = pd.to_numeric(values)
+        except ValueError:
+            df[column] = values
+    return df
+
+def clean_raw_data(n_jobs=1):
     '''
-    + Load preprocessed data
+    + Rename columns
+    + Correct the logging issue for TimeDelta = -100
+
+    Runs are processed in parallel using `n_jobs` processes
+    (n_jobs=None uses all the available cores).
+
+    Returns the number of corrected TimeDelta values.
+    '''
+    patched = sum(
+        __map_runs__(__clean_run__, list_runs(Path('data_raw_origin')), n_jobs))
+    print('Corrected %i TimeDelta values.' % patched)
+
+    return patched
+
+def group_PRR(df):
+    '''
+    Group the PRR values of the runs by setting, i.e., by
+    (TransPair, SamePayload, Mode, PowerDelta, TimeDelta), both for each
+    pair and for all pairs combined (TransPair = 'all'). Runs without
+    power delta estimate are not used.
+
+    All groups are processed at once: the data is sorted a single time
+    by group and PRR value.
+
+    Returns a tuple (groups, PRR, starts, counts) where `groups` is a
+    DataFrame with one row per setting, and the sorted PRR values of
+    setting i are PRR[starts[i]:starts[i]+counts[i]].
+    '''
+    keys = ['TransPair','SamePayload','Mode','PowerDelta','TimeDelta']
+
+    # Runs without power delta estimate are not used
+    df = df[df['PowerDelta'].notna()]
+
+    # Duplicate the data to compute the statistics over all pairs
+    data = pd.DataFrame({
+        'TransPair': np.concatenate([
+            df['TransPair'].values.astype(object),
+            np.full(len(df), 'all', dtype=object)]),
+        'SamePayload': np.tile(df['SamePayload'].values, 2),
+        'Mode': np.tile(df['Mode'].values, 2),
+        'PowerDelta': np.tile(df['PowerDelta'].values, 2),
+        'TimeDelta': np.tile(df['TimeDelta'].values, 2),
+        'PRR': np.tile(df['PRR'].values, 2),
+    })
+    data = data.sort_values(keys + ['PRR'], kind='mergesort')
+
+    # Find the group boundaries in the sorted data
+    new_group = np.zeros(len(data), dtype=bool)
+    new_group[:1] = True
+    for key in keys:
+        values = data[key].values
+        new_group[1:] |= (values[1:] != values[:-1])
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, len(data)))
+
+    groups = data.iloc[starts][keys].reset_index(drop=True)
+    return groups, data['PRR'].values, starts, counts
+
+def median_CI(PRR, starts, counts, ci_method='thompson', confidence=75):
+    '''
+    Compute the median and its two-sided confidence interval
+    (`confidence`, 75% by default) of groups of sorted values, with group i being
+    PRR[starts[i]:starts[i]+counts[i]] (see `group_PRR`).
+
+    The CI is either Thompson's order-statistics interval
+    (ci_method='thompson'), whose bounds are NaN for groups without
+    enough samples, or a bootstrap interval (ci_method='bootstrap',
+    see `BootstrapCI_twosided_batch`), defined for all groups.
+
+    Returns the arrays (median, LB, UB).
+    '''
+    # Median (average of the two middle values for even counts)
+    median = (PRR[starts + (counts-1)//2] + PRR[starts + counts//2]) / 2
+
+    if ci_method == 'bootstrap':
+        LB, UB = BootstrapCI_twosided_batch(PRR, starts, counts, 50, confidence)
+        return median, LB, UB
+    elif ci_method != 'thompson':
+        raise ValueError("Invalid ci_method: "+repr(ci_method)+". Valid 'ci_method' values: 'thompson' or 'bootstrap'")
+
+    # CI bounds (NaN if not enough samples)
+    LB_index, UB_index = ThompsonCI_twosided_batch(counts, 50, confidence)
+    valid = LB_index >= 0
+    LB = np.full(len(starts), np.nan)
+    UB = np.full(len(starts), np.nan)
+    LB[valid] = PRR[starts[valid] + LB_index[valid]]
+    UB[valid] = PRR[starts[valid] + UB_index[valid]]
+
+    return median, LB, UB
+
+def __trace_stats__(df, ci_method='thompson'):
+    '''
+    Compute the median PRR and its two-sided confidence interval (75%)
+    for every setting (see `group_PRR` and `median_CI`).
+
+    Returns a DataFrame with one row per group and the columns
+    TransPair, SamePayload, Mode, PowerDelta, TimeDelta, median, LB, UB.
+    '''
+    stats, PRR, starts, counts = group_PRR(df)
+    stats['median'], stats['LB'], stats['UB'] = median_CI(
+        PRR, starts, counts, ci_method)
+    return stats
+
+def __build_traces__(stats, x_name, slice_name, x_values, cell_list):
+    '''
+    Build the traces, with `x_name` as x-axis, for all the
+    (TransPair, SamePayload, `slice_name` value) tuples of `cell_list`.
+
+    Returns a dict mapping (TransPair, SamePayload, x_name, Delta)
+    to the DataFrame of the corresponding trace.
+    '''
+    # One row per x value and one column per (statistic, mode)
+    table = stats.set_index(
+        ['TransPair','SamePayload',slice_name,x_name,'Mode']
+        )[['median','LB','UB']].unstack('Mode')
+    slices = {
+        cell: cell_df.reset_index(level=[0,1,2], drop=True)
+        for cell, cell_df in table.groupby(level=[0,1,2])
+    }
+
+    traces = {}
+    for TransPair, SamePayload, Delta in cell_list:
+
+        # Initialize the storing DataFrame
+        df_median = pd.DataFrame()
+        df_median[x_name] = x_values
+
+        # Retrieve the statistics of the setting, if any
+        cell_df = slices.get((TransPair, SamePayload, Delta))
+        if cell_df is not None:
+            cell_df = cell_df.reindex(x_values)
+
+        for mode in Modes:
+            for stat in ['median','LB','UB']:
+                column = (stat, Modes[mode]['id'])
+                if cell_df is not None and column in cell_df:
+                    df_median[stat+'_'+mode] = cell_df[column].values
+                else:
+                    # Force displaying the trace, even if empty
+                    df_median[stat+'_'+mode] = np.nan
+
+        traces[(TransPair, int(SamePayload), x_name, int(Delta))] = df_median
+
+    return traces
+
+def trace_file_name(TransPair, SamePayload, axis, Delta):
+    '''
+    Name of the csv file of a trace, relative to the preprocessed data path.
+    '''
+    return (
+        Path(Parameters['TransPair'][TransPair]['path']) /
+        Parameters['SamePayload'][SamePayload]['path'] /
+        ('%sTraces_%s_%s_(%i).csv' % (axis,TransPair,SamePayload,Delta)))
+
+def save_traces(traces, data_path=Path('data_preprocessed')):
+    '''
+    Save the traces (see `__build_traces__`) as csv files in `data_path`.
+    '''
+    for key, df_median in traces.items():
+        file_name = trace_file_name(*key)
+        df_median.to_csv(data_path / file_name, index=False)
+        # Debug output
+        print('Done with %s' % file_name.name)
+
+def computeTraces(all_pairs=None, df=None, TimeDeltaCells=None, PowerDeltaCells=None, ci_method='thompson'):
+    '''
+    + Load preprocessed data (unless passed as `df`)
     + Compute the median and its two-sided
     confidence interval (75%) for each setting
-    + Save as csv
+    + Save as csv, both as function of the time delta
+    (`TimeDeltaTraces_*`) and of the power delta (`PowerDeltaTraces_*`)
+
+    The traces are computed for each pair (all_pairs=False),
+    for all pairs combined (all_pairs=True), or both (all_pairs=None).
+
+    Pass a set of (TransPair, SamePayload, PowerDelta) tuples as
+    `TimeDeltaCells` (resp. (TransPair, SamePayload, TimeDelta) tuples as
+    `PowerDeltaCells`) to only recompute the corresponding files;
+    pass an empty set to skip one of the two series.
+
+    Pass ci_method='bootstrap' to compute bootstrap confidence intervals
+    instead of Thompson's intervals (see `median_CI`).
     '''
 
     data_path = Path('data_preprocessed')
 
     # Load the PRR data
-    df = parse_all_data()
+    if df is None:
+        df = parse_all_data()
 
-    # X values we are interested in
-    TimeDeltaValues = sorted(df['TimeDelta'].dropna().unique())
+    # Pairs to process
+    TransPairList = []
+    if all_pairs is not True:
+        TransPairList += list(df['TransPair'].unique())
+    if all_pairs is not False:
+        TransPairList += ['all']
 
-    # Check if we do each pair individually or the combination of all
-    if all_pairs:
-        TransPairList = ['all']
-    else:
-        TransPairList = df['TransPair'].unique()
-
-
-    for TransPair in TransPairList:
-        for SamePayload in df['SamePayload'].unique():
-            for PowerDelta in sorted(df['PowerDelta'].dropna().unique()):
-
-                # Initialize the storing DataFrame
-                df_median = pd.DataFrame()
-                df_median["TimeDelta"] = TimeDeltaValues
-
-                # Filter the data to process
-                filter = (
-                    (df['SamePayload'] == SamePayload) &
-                    (df["PowerDelta"] == PowerDelta)
-                )
-                if not all_pairs:
-                    filter = filter & (df['TransPair'] == TransPair)
-                filtered_df = df.where(filter).dropna()
-
-                # Loop through the modes
-                for mode in Modes:
-                    # print(Modes[mode])
-
-                    # Filter specific mode data
-                    mode_filter = (filtered_df["Mode"] == Modes[mode]['id'])
-                    mode_df = filtered_df.where(mode_filter).dropna()
-
-                    # Prepare data to plot
-                    if len(mode_df) > 0:
-                        # Extract all data points
-                        y_data = mode_df["PRR"]
-
-                        # Compute the median and CI bounds
-                        y_median = []
-                        y_LB = []
-                        y_UB = []
-                        for x in TimeDeltaValues:
-                            median_filter = (mode_df["TimeDelta"] == x)
-                            median_data = sorted(mode_df.where(median_filter).dropna().PRR.tolist())
-                            # print(median_data)
-                            if len(median_data) > 0:
-                                y_median.append(np.median(median_data))
-                                LB, UB = ThompsonCI_twosided(len(median_data), 50, 75)
-                                # print(LB,UB)
-                                if LB is not np.nan:
-                                    y_LB.append(median_data[LB])
-                                    y_UB.append(median_data[UB])
-                                else:
-                                    y_LB.append(np.nan)
-                                    y_UB.append(np.nan)
-                            else:
-                                y_median.append(np.nan)
-                                y_LB.append(np.nan)
-                                y_UB.append(np.nan)
-                    else:
-                        # Force displaying the trace, even if empty
-                        y_median = [np.nan]*len(TimeDeltaValues)
-                        y_LB = [np.nan]*len(TimeDeltaValues)
-                        y_UB = [np.nan]*len(TimeDeltaValues)
-
-                    df_median['median_'+mode] = y_median
-                    df_median['LB_'+mode] = y_LB
-                    df_median['UB_'+mode] = y_UB
-
-                # Save DataFrame in CSV for fast reloading
-                file_path = data_path / Parameters['TransPair'][TransPair]['path'] / Parameters['SamePayload'][SamePayload]['path']
-                file_name = 'TimeDeltaTraces_%s_%s_(%i).csv' % (TransPair,SamePayload,PowerDelta)
-                df_median.to_csv(file_path / file_name, index=False)
-
-                # Debug output
-                print('Done with %s' % file_name)
-    return
+    stats = __trace_stats__(df, ci_method)
 
+    # Traces as a function of the time delta
+    TimeDeltaValues = sorted(df['TimeDelta'].dropna().unique())
+    cell_list = [
+        (TransPair, SamePayload, PowerDelta)
+        for TransPair in TransPairList
+        for SamePayload in df['SamePayload'].unique()
+        for PowerDelta in sorted(df['PowerDelta'].dropna().unique())
+    ]
+    if TimeDeltaCells is not None:
+        cell_list = [cell for cell in cell_list if cell in TimeDeltaCells]
+    traces = __build_traces__(
+        stats, 'TimeDelta', 'PowerDelta', TimeDeltaValues, cell_list)
+
+    # Traces as a function of the power delta
+    cell_list = [
+        (TransPair, SamePayload, TimeDelta)
+        for TransPair in TransPairList
+        for SamePayload in df['SamePayload'].unique()
+        for TimeDelta in df['TimeDelta'].dropna().unique()
+    ]
+    if PowerDeltaCells is not None:
+        cell_list = [cell for cell in cell_list if cell in PowerDeltaCells]
+    traces.update(__build_traces__(
+        stats, 'PowerDelta', 'TimeDelta', trace_PowerDelta_values, cell_list))
+
+    # Save DataFrames in CSV
+    save_traces(traces, data_path)
 
-def computePowerDeltaTraces(all_pairs=False):
+    return
 
-    data_path = Path('data_preprocessed')
+def computeTimeDeltaTraces(all_pairs=False, df=None, cells=None, ci_method='thompson'):
+    '''
+    Compute and save the `TimeDeltaTraces_*` files only;
+    see `computeTraces`.
 
-    # Load the PRR data
-    df = parse_all_data()
+    By default, the traces are computed for each pair; pass
+    all_pairs=True for all pairs combined, or all_pairs=None for both.
+    '''
+    computeTraces(all_pairs, df, TimeDeltaCells=cells, PowerDeltaCells=set(), ci_method=ci_method)
+    return
 
-    # X values we are interested in
-    x_median = np.arange(-16, 17)
+def computePowerDeltaTraces(all_pairs=False, df=None, cells=None, ci_method='thompson'):
+    '''
+    Compute and save the `PowerDeltaTraces_*` files only;
+    see `computeTraces`.
 
-    # Check if we do each pair individually or the combination of all
-    if all_pairs:
-        TransPairList = ['all']
-    else:
-        TransPairList = df['TransPair'].unique()
-
-    for TransPair in TransPairList:
-        for SamePayload in df['SamePayload'].unique():
-            for TimeDelta in df['TimeDelta'].dropna().unique():
-
-                # Initialize the storing DataFrame
-                df_median = pd.DataFrame()
-                df_median["PowerDelta"] = x_median
-
-                # Filter the data to process
-                filter = (
-                    (df['SamePayload'] == SamePayload) &
-                    (df["TimeDelta"] == TimeDelta)
-                )
-                if not all_pairs:
-                    filter = filter & (df['TransPair'] == TransPair)
-                filtered_df = df.where(filter).dropna()
-
-                # Loop through the modes
-                for mode in Modes:
-
-                    # Filter specific mode data
-                    mode_filter = (filtered_df["Mode"] == Modes[mode]['id'])
-                    mode_df = filtered_df.where(mode_filter).dropna()
-
-                    # Prepare data to plot
-                    if len(mode_df) > 0:
-                        # Extract all data points
-                        y_data = mode_df["PRR"]
-
-                        # Compute the median and CI bounds
-                        y_median = []
-                        y_LB = []
-                        y_UB = []
-                        for x in x_median:
-                            median_filter = (mode_df["PowerDelta"] == x)
-                            median_data = sorted(mode_df.where(median_filter).dropna().PRR.tolist())
-                            if len(median_data) > 0:
-                                y_median.append(np.median(median_data))
-                                LB, UB = ThompsonCI_twosided(len(median_data), 50, 75)
-                                # print(LB,UB)
-                                if LB is not np.nan:
-                                    y_LB.append(median_data[LB])
-                                    y_UB.append(median_data[UB])
-                                else:
-                                    y_LB.append(np.nan)
-                                    y_UB.append(np.nan)
-                            else:
-                                y_median.append(np.nan)
-                                y_LB.append(np.nan)
-                                y_UB.append(np.nan)
-                    else:
-                        # Force displaying the trace, even if empty
-                        y_median = [np.nan]*len(x_median)
-                        y_LB = [np.nan]*len(x_median)
-                        y_UB = [np.nan]*len(x_median)
-
-                    df_median['median_'+mode] = y_median
-                    df_median['LB_'+mode] = y_LB
-                    df_median['UB_'+mode] = y_UB
-
-                # Save DataFrame in CSV for fast reloading
-                file_path = data_path / Parameters['TransPair'][TransPair]['path'] / Parameters['SamePayload'][SamePayload]['path']
-                file_name = 'PowerDeltaTraces_%s_%s_(%i).csv' % (TransPair,SamePayload,TimeDelta)
-                df_median.to_csv(file_path / file_name, index=False)
-
-                # Debug output
-                print('Done with %s' % file_name)
+    By default, the traces are computed for each pair; pass
+    all_pairs=True for all pairs combined, or all_pairs=None for both.
+    '''
+    computeTraces(all_pairs, df, TimeDeltaCells=set(), PowerDeltaCells=cells, ci_method=ci_method)
     return
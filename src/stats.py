@@ -4,20 +4,17 @@ But it's in here for now.
 '''
 
 import numpy as np
-import scipy.stats
 
-def ThompsonCI_onesided( n_samples, percentile, confidence, CI_side='lower', verbose=False):
-    '''This function computes a one-sided confidence interval for the given
-    percentile, with the given confidence level.
-    Unless CI_side='upper', a lower-bound is computed.
-    The index of the sample is returned.
-    None is returned if there are not enough samples for the desired CI.
-    '''
+# Memoized CI indices, keyed by (n_samples, percentile, confidence, CI_side)
+__ThompsonCI_cache__ = {}
+
+# Memoized resampling ranks, keyed by (n_samples, percentile, n_resamples, seed)
+__Bootstrap_cache__ = {}
 
-    ##
-    # Checking the inputs
-    ##
+# Maximal number of bootstrap estimates computed at once
+bootstrap_chunk_size = 10**6
 
+def __check_inputs__(percentile, confidence, CI_side='lower'):
     # Confidence and percentile must be between 0 and 100
     if confidence >= 100 or confidence <= 0:
         raise ValueError("Invalid confidence: "+repr(confidence)+". Provide a real number strictly between 0 and 100.")
@@ -28,34 +25,95 @@ def ThompsonCI_onesided( n_samples, percentile, confidence, CI_side='lower', ver
     if not (CI_side == 'lower' or CI_side == 'upper'):
         raise ValueError("Invalid CI_side: "+repr(CI_side)+". Valid 'CI_side' values: 'lower' or 'upper'")
 
-    # Define the working percentile
-    if CI_side == 'upper':
-        p_work = 100 - percentile
-    else:
-        p_work = percentile
+def __ThompsonCI_search__(n_samples, p_work, confidence):
+    '''
+    For each number of samples n, binary search of the first index k in
+    [0, n-1] such that P(X > k) < confidence, where X ~ Binomial(n, p_work).
+    Returns the index k-1 (n-1 if there is no such index), or -1 if
+    the condition already holds for k = 0.
+    '''
+    # scipy.stats is slow to import: only done when CIs are computed
+    import scipy.stats
+
+    n_samples = np.asarray(n_samples, dtype='int64')
+    lo = np.zeros(len(n_samples), dtype='int64')
+    hi = n_samples.copy()
+    active = lo < hi
+    while active.any():
+        mid = (lo[active] + hi[active]) // 2
+        below = (1 - scipy.stats.binom.cdf(mid, n_samples[active], p_work)) < confidence
+        hi[active] = np.where(below, mid, hi[active])
+        lo[active] = np.where(below, lo[active], mid + 1)
+        active = lo < hi
+    # lo is now the first index reaching below the desired confidence
+    CI = np.where(lo == n_samples, n_samples - 1, lo - 1)
+    CI[lo == 0] = -1
+    return CI
+
+def ThompsonCI_onesided_batch( n_samples, percentile, confidence, CI_side='lower'):
+    '''Same as `ThompsonCI_onesided`, for an array of numbers of samples.
+    Returns an array of sample indexes, where -1 indicates that there are
+    not enough samples for the desired CI.
+
+    The results are memoized; each new number of samples costs
+    O(log n) evaluations of the binomial CDF.
+    '''
+    __check_inputs__(percentile, confidence, CI_side)
+    n_samples = np.asarray(n_samples, dtype='int64')
+
+    # Compute the CI for the numbers of samples not yet in the cache
+    unique_n = np.unique(n_samples)
+    todo = [n for n in unique_n
+            if (n, percentile, confidence, CI_side) not in __ThompsonCI_cache__]
+    if len(todo) > 0:
+        # Define the working percentile
+        if CI_side == 'upper':
+            p_work = 100 - percentile
+        else:
+            p_work = percentile
+        todo = np.array(todo, dtype='int64')
+        CI = __ThompsonCI_search__(todo, p_work/100, confidence/100)
+        # Return the requested CI index
+        if CI_side == 'upper':
+            CI = np.where(CI < 0, -1, (todo-1) - CI) # First index is 0 (not 1)
+        for n, index in zip(todo, CI):
+            __ThompsonCI_cache__[(n, percentile, confidence, CI_side)] = index
+
+    # Gather the results
+    lookup = np.array([
+        __ThompsonCI_cache__[(n, percentile, confidence, CI_side)] for n in unique_n
+    ], dtype='int64')
+    return lookup[np.searchsorted(unique_n, n_samples)]
+
+def ThompsonCI_twosided_batch( n_samples, percentile, confidence):
+    '''Same as `ThompsonCI_twosided`, for an array of numbers of samples.
+    Returns two arrays of sample indexes (lower and upper bounds), where -1
+    indicates that there are not enough samples for the desired CI.
+    '''
+    __check_inputs__(percentile, confidence)
+
+    # Compute the one-sided confidence
+    confidence_one_sided = (confidence+100)/2
+
+    LB = ThompsonCI_onesided_batch(
+        n_samples, percentile, confidence_one_sided, CI_side='lower')
+    UB = ThompsonCI_onesided_batch(
+        n_samples, percentile, confidence_one_sided, CI_side='upper')
+    return LB, UB
 
-    # compute all probabilities from the binomiale distribution for the percentile of interest
-    bd=scipy.stats.binom(n_samples,p_work/100)
-    ppm = [np.maximum(1-x,0.0) for x in np.cumsum([bd.pmf(k) for k in range(n_samples)])]
-    # print([bd.pmf(k) for k in range(n_samples+1)])
-    # print(ppm)
+def ThompsonCI_onesided( n_samples, percentile, confidence, CI_side='lower', verbose=False):
+    '''This function computes a one-sided confidence interval for the given
+    percentile, with the given confidence level.
+    Unless CI_side='upper', a lower-bound is computed.
+    The index of the sample is returned.
+    None is returned if there are not enough samples for the desired CI.
+    '''
 
-    # search the index defining a lower-bound for p_work
-    if ppm[0] < confidence/100:
+    CI = ThompsonCI_onesided_batch(
+        [n_samples], percentile, confidence, CI_side)[0]
+    if CI < 0:
         return np.nan
-    else:
-        for k in range(n_samples):
-            # search for first index reaching below the desired confidence
-            if ppm[k] < confidence/100:
-                # lower-bound is the previous index
-                CI = k-1
-                break
-
-    # return the requested CI index
-    if CI_side == 'lower':
-        return CI
-    else:
-        return ((n_samples-1) - CI) # First index is 0 (not 1)
+    return int(CI)
 
 def ThompsonCI_twosided( n_samples, percentile, confidence,  verbose=False):
     '''
@@ -67,11 +125,7 @@ def ThompsonCI_twosided( n_samples, percentile, confidence,  verbose=False):
     a two-sided CI.
     '''
 
-    # Confidence and percentile must be between 0 and 100
-    if confidence >= 100 or confidence <= 0:
-        raise ValueError("Invalid confidence: "+repr(confidence)+". Provide a real number strictly between 0 and 100.")
-    if percentile >= 100 or percentile <= 0:
-        raise ValueError("Invalid percentile: "+repr(percentile)+". Provide a real number strictly between 0 and 100.")
+    __check_inputs__(percentile, confidence)
 
     # Compute the one-sided confidence
     confidence_one_sided = (confidence+100)/2
@@ -83,3 +137,57 @@ def ThompsonCI_twosided( n_samples, percentile, confidence,  verbose=False):
         n_samples, percentile, confidence_one_sided, CI_side='upper')
 
     return LB, UB
+
+def __bootstrap_ranks__(n_samples, percentile, n_resamples, seed):
+    '''
+    Draw `n_resamples` resamples (with replacement) of the indexes of
+    `n_samples` sorted samples, with a seed depending only on `seed` and
+    `n_samples`. Returns the two sample indexes to interpolate between to
+    get the percentile of each resample, and the interpolation weight.
+    '''
+    key = (n_samples, percentile, n_resamples, seed)
+    if key not in __Bootstrap_cache__:
+        rng = np.random.RandomState([seed, n_samples])
+        # The samples being sorted, sorting the indexes sorts the resamples
+        index = np.sort(
+            rng.randint(0, n_samples, size=(n_resamples, n_samples)), axis=1)
+        # Percentile with linear interpolation (as `np.percentile`)
+        rank = percentile/100 * (n_samples-1)
+        lo = int(np.floor(rank))
+        hi = int(np.ceil(rank))
+        __Bootstrap_cache__[key] = (index[:, lo], index[:, hi], rank - lo)
+    return __Bootstrap_cache__[key]
+
+def BootstrapCI_twosided_batch( values, starts, counts, percentile, confidence, n_resamples=1000, seed=0):
+    '''Compute a two-sided bootstrap confidence interval (percentile method)
+    for the given percentile, with the given confidence level, for groups
+    of sorted values, group i being values[starts[i]:starts[i]+counts[i]].
+
+    All groups of the same size are resampled at once, using a single
+    matrix of random sample indexes drawn with a fixed seed: the results
+    are reproducible and do not depend on the other groups.
+
+    Returns two arrays of values (lower and upper bounds),
+    NaN for empty groups.
+    '''
+    __check_inputs__(percentile, confidence)
+    values = np.asarray(values, dtype='float64')
+    starts = np.asarray(starts, dtype='int64')
+    counts = np.asarray(counts, dtype='int64')
+
+    alpha = (100-confidence)/2
+    LB = np.full(len(starts), np.nan)
+    UB = np.full(len(starts), np.nan)
+    for n_samples in np.unique(counts[counts > 0]):
+        lo, hi, weight = __bootstrap_ranks__(
+            n_samples, percentile, n_resamples, seed)
+        groups = np.flatnonzero(counts == n_samples)
+        n_chunks = max(1, len(groups) * n_resamples // bootstrap_chunk_size)
+        for chunk in np.array_split(groups, n_chunks):
+            # One estimate per (group, resample)
+            first = starts[chunk][:, None]
+            estimates = (
+                values[first + lo] * (1-weight) + values[first + hi] * weight)
+            LB[chunk], UB[chunk] = np.percentile(
+                estimates, [alpha, 100-alpha], axis=1)
+    return LB, UB
@@ -1,5 +1,3 @@
-from pathlib import Path
-
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
@@ -7,213 +5,240 @@ from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
 
 from app import app
-from src.preprocess import parse_all_data
-from src.helpers import Modes, Parameters
-from src.plots import prr_f_TimeDelta, prr_f_PowerDelta, prr_3d
+from src.context import get_data_cube, get_TimeDeltaValues
+from src.helpers import Modes, Parameters, ConfidenceLevels, PowerDeltaBins
+from src.plots import prr_f_TimeDelta, prr_f_PowerDelta, prr_3d, pointBudget3d, update_layout
+from src.export import load_figure
 import src.colors as colors
 
-# Load the main DataFrame
-DataPath = Path('data_preprocessed')
-df = parse_all_data()
-TimeDeltaValues = sorted(df['TimeDelta'].dropna().unique())
-
-# Initialize the figures
-TimeDelta_plot = go.Figure()
-PowerDelta_plot = go.Figure()
-threeD_plot = go.Figure()
-
 # Helpers
 Show3dPlot = 1
 ShowMarkers = 2
 ShowCI = 3
+ShowAllRuns3d = 4
 
-layout = html.Div([
+# Layout of the tab, built on its first visit (see `render_content` in index.py)
+def get_layout():
 
-    # Tab introduction
-    html.Div(
-        html.P([
-            html.H2('General exploration'),
-            html.Strong('''
-            For all physical layers (Bluetooth 5 and 802.15.4),
-            synchronous tranmittions eventually succeed with sufficiently strong power delta
-            and/or sufficiently small time delta.
-            '''),
-            html.Br(style={'margin-bottom':10}),
-            html.Span('''
-            The 3D plot shows that the PRR always rises to 100% then the power delta is large; that's the capture effect.
-            '''),
-            html.Br(style={'margin-bottom':0}),
-            html.Span('''
-            For smaller power delta, PRR drops to zero unless the time delta is small; that's the constructive interference effect.
-            '''),
-        ],
-        style={
-            'width':'50%',
-            'margin-left':20,
-            'margin-bottom':20,}),
-    ),
+    # Time delta values, from the data shared by all tabs
+    TimeDeltaValues = get_TimeDeltaValues()
 
-    # Container row
-    html.Div([
+    return html.Div([
 
-        # Box title
-        html.H3('Data selectors'),
-
-        # Basic instructions
-        html.Div([
-            html.Span('''
-                The following settings filter the data being showed in the plots below.
+        # Tab introduction
+        html.Div(
+            html.P([
+                html.H2('General exploration'),
+                html.Strong('''
+                For all physical layers (Bluetooth 5 and 802.15.4),
+                synchronous tranmittions eventually succeed with sufficiently strong power delta
+                and/or sufficiently small time delta.
                 '''),
-            html.Br(),
-            html.Span('''
-                > The default settings reproduce the figure shown in the paper.
+                html.Br(style={'margin-bottom':10}),
+                html.Span('''
+                The 3D plot shows that the PRR always rises to 100% then the power delta is large; that's the capture effect.
                 '''),
-            html.Br(),
-            html.Span('''
-                > You can change the settings and update the plots by clicking the "Update plots" button.
+                html.Br(style={'margin-bottom':0}),
+                html.Span('''
+                For smaller power delta, PRR drops to zero unless the time delta is small; that's the constructive interference effect.
                 '''),
             ],
             style={
-                # border
-                'border-left':'solid',
-                'border-width':5,
-                'border-color':colors.orange,
-                'background-color':colors.light_orange,
-                # rest
-                'padding':10,
                 'width':'50%',
-                'margin-bottom':20
-            }
+                'margin-left':20,
+                'margin-bottom':20,}),
         ),
 
-        # Physical layers
-        html.H5('Physical layers to display'),
-        dcc.Checklist(
-            id='modes',
-            options=[
-                {'label' : Modes[i]['label'], 'value': i} for i in Modes
-            ],
-            value=[i for i in Modes],
-            labelStyle={
-                'display': 'inline-block',
-                'padding-right':10}
-        ),
-
-        html.H5('Transmitted packets'),
-        dcc.RadioItems(
-            id='packet-type',
-            options=[
-                {'label': 'Same Payload', 'value': 1},
-                {'label': 'Different Payload', 'value': 0},
-             ],
-            value=1
-        ),
-
-        # Transmitter pairs
-        html.H5('Pairs of transmitter to display'),
-        dcc.RadioItems(
-            id='transmitter-pair',
-            options=[
-                {'label': 'Pair A', 'value': 'A'},
-                {'label': 'Pair B', 'value': 'B'},
-                {'label': 'Both', 'value': 'all'},
-             ],
-            value='all',
-            labelStyle={
-                'display': 'inline-block',
-                'padding-right':10}
-        ),
+        # Container row
+        html.Div([
 
-        # Other options
-        html.H5('Other options'),
-        dcc.Checklist(
-            id='enable-options',
-            options=[
-                {'label' : 'Show 3D plot', 'value': Show3dPlot},
-                {'label' : 'Show individual run data', 'value': ShowMarkers},
-                {'label' : 'Show confidence intervals', 'value': ShowCI},
-            ],
-            value=[Show3dPlot,ShowCI],
-            labelStyle={
-                'display': 'inline-block',
-                'padding-right':10}
-        ),
+            # Box title
+            html.H3('Data selectors'),
 
-        # Submit button
-        html.Button(
-            id='submit-button-state',
-            n_clicks=0,
-            children='Update plots',
-            style={
-                'margin-top':20,
-                'background-color':'white'
+            # Basic instructions
+            html.Div([
+                html.Span('''
+                    The following settings filter the data being showed in the plots below.
+                    '''),
+                html.Br(),
+                html.Span('''
+                    > The default settings reproduce the figure shown in the paper.
+                    '''),
+                html.Br(),
+                html.Span('''
+                    > You can change the settings and update the plots by clicking the "Update plots" button.
+                    '''),
+                ],
+                style={
+                    # border
+                    'border-left':'solid',
+                    'border-width':5,
+                    'border-color':colors.orange,
+                    'background-color':colors.light_orange,
+                    # rest
+                    'padding':10,
+                    'width':'50%',
+                    'margin-bottom':20
                 }
-        ),
-
-    ], style={
-        'background-color':colors.light_grey,
-        'padding':20
-        }
-    ),
+            ),
 
-    # Containing row
-    html.Div([
+            # Physical layers
+            html.H5('Physical layers to display'),
+            dcc.Checklist(
+                id='modes',
+                options=[
+                    {'label' : Modes[i]['label'], 'value': i} for i in Modes
+                ],
+                value=[i for i in Modes],
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
+            ),
 
-        # Fist column
-        html.Div([
+            html.H5('Transmitted packets'),
+            dcc.RadioItems(
+                id='packet-type',
+                options=[
+                    {'label': 'Same Payload', 'value': 1},
+                    {'label': 'Different Payload', 'value': 0},
+                 ],
+                value=1
+            ),
 
-            # =================
-            # 3D Graph
-            # =================
-            dcc.Graph(
-                id='3d_graph',
-                figure=threeD_plot
+            # Transmitter pairs
+            html.H5('Pairs of transmitter to display'),
+            dcc.RadioItems(
+                id='transmitter-pair',
+                options=[
+                    {'label': 'Pair A', 'value': 'A'},
+                    {'label': 'Pair B', 'value': 'B'},
+                    {'label': 'Both', 'value': 'all'},
+                 ],
+                value='all',
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
             ),
-        ], className="six columns"),
 
-        # Second column
-        html.Div([
-            # ================
-            # Time Delta Graph
-            # ================
-            dcc.Graph(
-                id='TimeDelta_graph',
-                figure=TimeDelta_plot
+            # Other options
+            html.H5('Other options'),
+            dcc.Checklist(
+                id='enable-options',
+                options=[
+                    {'label' : 'Show 3D plot', 'value': Show3dPlot},
+                    {'label' : 'Show individual run data', 'value': ShowMarkers},
+                    {'label' : 'Show confidence intervals', 'value': ShowCI},
+                    {'label' : 'Show all runs in the 3D plot (slower)', 'value': ShowAllRuns3d},
+                ],
+                value=[Show3dPlot,ShowCI],
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
             ),
-            html.Label('Select an estimated power delta at the receiver (in dB)'),
-            dcc.Slider(
-                id='power-slider',
-                min=-16,
-                max=16,
+
+            # Power delta binning
+            html.H5('Power delta binning'),
+            dcc.RadioItems(
+                id='power-binning',
+                options=[
+                    {'label' : b['label'], 'value': b['value']} for b in PowerDeltaBins
+                ] + [
+                    {'label' : '|Power delta| ≥ selected value (time delta plot)', 'value': 'min'},
+                ],
                 value=0,
-                marks={str(Delta): str(Delta) for Delta in range(-16,17)},
-                step=None,
-                included=False
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
             ),
 
-            # Horizontal separator
-            html.Hr(),
+            # Confidence level
+            html.H5('Confidence level of the intervals'),
+            dcc.RadioItems(
+                id='confidence-level',
+                options=[
+                    {'label' : '%i%%' % level, 'value': level} for level in ConfidenceLevels
+                ],
+                value=75,
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
+            ),
 
-            # =================
-            # Power Delta Graph
-            # =================
-            dcc.Graph(
-                id='PowerDelta_graph',
-                figure=PowerDelta_plot
+            # Submit button
+            html.Button(
+                id='submit-button-state',
+                n_clicks=0,
+                children='Update plots',
+                style={
+                    'margin-top':20,
+                    'background-color':'white'
+                    }
             ),
-            html.Label('Select an estimated time delta between transmittions (in ticks)'),
-            dcc.Slider(
-                    id='time-slider',
-                    min=-140,
-                    max=140,
+
+        ], style={
+            'background-color':colors.light_grey,
+            'padding':20
+            }
+        ),
+
+        # Containing row
+        html.Div([
+
+            # Fist column
+            html.Div([
+
+                # =================
+                # 3D Graph
+                # =================
+                dcc.Graph(
+                    id='3d_graph',
+                    figure=load_figure('general_3d')
+                ),
+            ], className="six columns"),
+
+            # Second column
+            html.Div([
+                # ================
+                # Time Delta Graph
+                # ================
+                dcc.Graph(
+                    id='TimeDelta_graph',
+                    figure=load_figure('general_TimeDelta')
+                ),
+                html.Label('Select an estimated power delta at the receiver (in dB)'),
+                dcc.Slider(
+                    id='power-slider',
+                    min=-16,
+                    max=16,
                     value=0,
-                    marks={str(Delta): str(Delta) for Delta in TimeDeltaValues},
+                    marks={str(Delta): str(Delta) for Delta in range(-16,17)},
                     step=None,
                     included=False
                 ),
-        ], className="six columns"),
-    ], className="row")
-])
+
+                # Horizontal separator
+                html.Hr(),
+
+                # =================
+                # Power Delta Graph
+                # =================
+                dcc.Graph(
+                    id='PowerDelta_graph',
+                    figure=load_figure('general_PowerDelta')
+                ),
+                html.Label('Select an estimated time delta between transmittions (in ticks)'),
+                dcc.Slider(
+                        id='time-slider',
+                        min=-140,
+                        max=140,
+                        value=0,
+                        marks={str(Delta): str(Delta) for Delta in TimeDeltaValues},
+                        step=None,
+                        included=False
+                    ),
+            ], className="six columns"),
+        ], className="row")
+    ])
 
 
 @app.callback(
@@ -223,19 +248,24 @@ layout = html.Div([
     [State('packet-type', 'value'),
      State('transmitter-pair', 'value'),
      State('modes', 'value'),
-     State('enable-options', 'value'),])
-def update_TimeDelta_graph(n_clicks,PowerDelta,SamePayload,TransPair,ModesToShow,Enable):
+     State('enable-options', 'value'),
+     State('confidence-level', 'value'),
+     State('power-binning', 'value'),],
+    prevent_initial_call=True)
+def update_TimeDelta_graph(n_clicks,PowerDelta,SamePayload,TransPair,ModesToShow,Enable,Confidence,PowerBin):
     figure = prr_f_TimeDelta(
-        df,
+        get_data_cube(),
         PowerDelta,
         SamePayload,
         TransPair,
         ModesToShow,
-        DataPath,
         showMarkers=(ShowMarkers in Enable),
-        showCI=(ShowCI in Enable)
+        showCI=(ShowCI in Enable),
+        confidence=Confidence,
+        powerBin=PowerBin,
+        as_dict=True
         )
-    figure.update_layout(dict(xaxis = {'range':[-120,120]}))
+    update_layout(figure, dict(xaxis = {'range':[-120,120]}))
     return figure
 
 
@@ -246,17 +276,22 @@ def update_TimeDelta_graph(n_clicks,PowerDelta,SamePayload,TransPair,ModesToShow
     [State('packet-type', 'value'),
      State('transmitter-pair', 'value'),
      State('modes', 'value'),
-     State('enable-options', 'value'),])
-def update_PowerDelta_graph(n_clicks,TimeDelta,SamePayload,TransPair,ModesToShow,Enable):
+     State('enable-options', 'value'),
+     State('confidence-level', 'value'),
+     State('power-binning', 'value'),],
+    prevent_initial_call=True)
+def update_PowerDelta_graph(n_clicks,TimeDelta,SamePayload,TransPair,ModesToShow,Enable,Confidence,PowerBin):
     return prr_f_PowerDelta(
-        df,
+        get_data_cube(),
         TimeDelta,
         SamePayload,
         TransPair,
         ModesToShow,
-        DataPath,
         showMarkers=(ShowMarkers in Enable),
-        showCI=(ShowCI in Enable)
+        showCI=(ShowCI in Enable),
+        confidence=Confidence,
+        powerBin=PowerBin,
+        as_dict=True
         )
 
 @app.callback(
@@ -265,14 +300,17 @@ def update_PowerDelta_graph(n_clicks,TimeDelta,SamePayload,TransPair,ModesToShow
     [State('packet-type', 'value'),
      State('transmitter-pair', 'value'),
      State('modes', 'value'),
-     State('enable-options', 'value'),])
+     State('enable-options', 'value'),],
+    prevent_initial_call=True)
 def update_threeD_graph(n_clicks,SamePayload,TransPair,ModesToShow,Enable):
     if Show3dPlot in Enable:
         return prr_3d(
-            df,
+            get_data_cube(),
             SamePayload,
             TransPair,
-            ModesToShow
+            ModesToShow,
+            pointBudget=(None if ShowAllRuns3d in Enable else pointBudget3d),
+            as_dict=True
             )
     else:
         return go.Figure()
@@ -1,200 +1,221 @@
-from pathlib import Path
-
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
 
-import plotly.graph_objects as go
-
 from app import app
-from src.preprocess import parse_all_data
-from src.helpers import Modes, Parameters
+from src.context import get_data_cube, get_TimeDeltaValues
+from src.helpers import Modes, Parameters, ConfidenceLevels, PowerDeltaBins
 from src.plots import prr_f_PowerDelta
+from src.export import load_figure
 import src.colors as colors
 
-# Load the main DataFrame
-DataPath = Path('data_preprocessed')
-df = parse_all_data()
-TimeDeltaValues = sorted(df['TimeDelta'].dropna().unique())
-
-# Initialize the figures
-SamePacket_plot = go.Figure()
-DiffPacket_plot = go.Figure()
-
 # Helpers
 Show3dPlot = 1
 ShowMarkers = 2
 ShowCI = 3
 
-layout = html.Div([
-
-    html.Div(
-        html.P([
-            html.H2('The Power Capture Effect'),
-            html.Strong('Synchronous Transmissions are successful for all modes when the power delta at the receiver becomes sufficient.'),
-            html.Br(style={'margin-bottom':10}),
-            html.Span('''
-                When the same packet is sent by the transmitters (left plot), the median PRR is close to or larger than 50%
-                even without any power delta. In these conditions, the “constructive interference” effect helps the reception of ST.
-                '''
-            ),
-            html.Br(style={'margin-bottom':10}),
-            html.Span('''
-                When different packets are sent (right plot), the PRR requires a larger power delta (between 2 and 10 dB depending on the mode) to reach 100%.
-                The minimum power delta beyond which ST is successful independently of the time delta (i.e., capture effect threshold) is even larger.
-                '''
-            ),
-            html.Br(),
-            html.Span('''
-                This can be observed by changing the time delta (slider below the plots).
-                '''
-            ),
-        ],
-        style={
-            'width':'50%',
-            'margin-left':20,
-            'margin-bottom':20,}),
-    ),
-
-    # =================
-    # Data Selectors
-    # =================
+# Layout of the tab, built on its first visit (see `render_content` in index.py)
+def get_layout():
 
-    # Container row
-    html.Div([
+    # Time delta values, from the data shared by all tabs
+    TimeDeltaValues = get_TimeDeltaValues()
 
-        # Box title
-        html.H3('Data selectors'),
+    return html.Div([
 
-        # Basic instructions
-        html.Div([
-            html.Span('''
-                The following settings filter the data being showed in the plots below.
-                '''),
-            html.Br(),
-            html.Span('''
-                > The default settings reproduce the figure shown in the paper.
-                '''),
-            html.Br(),
-            html.Span('''
-                > You can change the settings and update the plots by clicking the "Update plots" button.
-                '''),
+        html.Div(
+            html.P([
+                html.H2('The Power Capture Effect'),
+                html.Strong('Synchronous Transmissions are successful for all modes when the power delta at the receiver becomes sufficient.'),
+                html.Br(style={'margin-bottom':10}),
+                html.Span('''
+                    When the same packet is sent by the transmitters (left plot), the median PRR is close to or larger than 50%
+                    even without any power delta. In these conditions, the “constructive interference” effect helps the reception of ST.
+                    '''
+                ),
+                html.Br(style={'margin-bottom':10}),
+                html.Span('''
+                    When different packets are sent (right plot), the PRR requires a larger power delta (between 2 and 10 dB depending on the mode) to reach 100%.
+                    The minimum power delta beyond which ST is successful independently of the time delta (i.e., capture effect threshold) is even larger.
+                    '''
+                ),
+                html.Br(),
+                html.Span('''
+                    This can be observed by changing the time delta (slider below the plots).
+                    '''
+                ),
             ],
             style={
-                # border
-                'border-left':'solid',
-                'border-width':5,
-                'border-color':colors.orange,
-                'background-color':colors.light_orange,
-                # rest
-                'padding':10,
                 'width':'50%',
-                'margin-bottom':20
-            }),
-
-        # Physical layers
-        html.H5('Physical layers to display'),
-        dcc.Checklist(
-            id='modes',
-            options=[
-                {'label' : Modes[i]['label'], 'value': i} for i in Modes
-            ],
-            value=[i for i in Modes],
-            labelStyle={
-                'display': 'inline-block',
-                'padding-right':10}
+                'margin-left':20,
+                'margin-bottom':20,}),
         ),
 
-        # Transmitter pairs
-        html.H5('Pairs of transmitter to display'),
-        dcc.RadioItems(
-            id='transmitter-pair',
-            options=[
-                {'label': 'Pair A', 'value': 'A'},
-                {'label': 'Pair B', 'value': 'B'},
-                {'label': 'Both', 'value': 'all'},
-             ],
-            value='all',
-            labelStyle={
-                'display': 'inline-block',
-                'padding-right':10}
-        ),
+        # =================
+        # Data Selectors
+        # =================
 
-        # Other options
-        html.H5('Other options'),
-        dcc.Checklist(
-            id='enable-options',
-            options=[
-                # {'label' : 'Show 3D plot', 'value': Show3dPlot},
-                {'label' : 'Show individual run data', 'value': ShowMarkers},
-                {'label' : 'Show confidence intervals', 'value': ShowCI}
-            ],
-            value=[ShowCI],
-            labelStyle={
-                'display': 'inline-block',
-                'padding-right':10}
-        ),
+        # Container row
+        html.Div([
 
-        # Submit button
-        html.Button(
-            id='submit-button-state',
-            n_clicks=0,
-            children='Update plots',
-            style={
-                'margin-top':20,
-                'background-color':'white'
-                }
-        ),
+            # Box title
+            html.H3('Data selectors'),
 
-    ], style={
-        'background-color':colors.light_grey,
-        'padding':20
-        }),
+            # Basic instructions
+            html.Div([
+                html.Span('''
+                    The following settings filter the data being showed in the plots below.
+                    '''),
+                html.Br(),
+                html.Span('''
+                    > The default settings reproduce the figure shown in the paper.
+                    '''),
+                html.Br(),
+                html.Span('''
+                    > You can change the settings and update the plots by clicking the "Update plots" button.
+                    '''),
+                ],
+                style={
+                    # border
+                    'border-left':'solid',
+                    'border-width':5,
+                    'border-color':colors.orange,
+                    'background-color':colors.light_orange,
+                    # rest
+                    'padding':10,
+                    'width':'50%',
+                    'margin-bottom':20
+                }),
 
-    # =================
-    # Plots row
-    # =================
-    html.Div([
+            # Physical layers
+            html.H5('Physical layers to display'),
+            dcc.Checklist(
+                id='modes',
+                options=[
+                    {'label' : Modes[i]['label'], 'value': i} for i in Modes
+                ],
+                value=[i for i in Modes],
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
+            ),
 
-        # =================
-        # Fist column
-        html.Div([
-            # -> Same packet content
-            dcc.Graph(
-                id='SamePacket_graph',
-                figure=SamePacket_plot
+            # Transmitter pairs
+            html.H5('Pairs of transmitter to display'),
+            dcc.RadioItems(
+                id='transmitter-pair',
+                options=[
+                    {'label': 'Pair A', 'value': 'A'},
+                    {'label': 'Pair B', 'value': 'B'},
+                    {'label': 'Both', 'value': 'all'},
+                 ],
+                value='all',
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
             ),
-        ], className="six columns"),
-        # =================
 
-        # =================
-        # Second column
-        html.Div([
-            # -> Diff packet content
-            dcc.Graph(
-                id='DiffPacket_graph',
-                figure=DiffPacket_plot
+            # Other options
+            html.H5('Other options'),
+            dcc.Checklist(
+                id='enable-options',
+                options=[
+                    # {'label' : 'Show 3D plot', 'value': Show3dPlot},
+                    {'label' : 'Show individual run data', 'value': ShowMarkers},
+                    {'label' : 'Show confidence intervals', 'value': ShowCI}
+                ],
+                value=[ShowCI],
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
+            ),
+
+            # Power delta binning
+            html.H5('Power delta binning'),
+            dcc.RadioItems(
+                id='power-binning',
+                options=[
+                    {'label' : b['label'], 'value': b['value']} for b in PowerDeltaBins
+                ],
+                value=0,
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
             ),
-        ], className="six columns"),
+
+            # Confidence level
+            html.H5('Confidence level of the intervals'),
+            dcc.RadioItems(
+                id='confidence-level',
+                options=[
+                    {'label' : '%i%%' % level, 'value': level} for level in ConfidenceLevels
+                ],
+                value=75,
+                labelStyle={
+                    'display': 'inline-block',
+                    'padding-right':10}
+            ),
+
+            # Submit button
+            html.Button(
+                id='submit-button-state',
+                n_clicks=0,
+                children='Update plots',
+                style={
+                    'margin-top':20,
+                    'background-color':'white'
+                    }
+            ),
+
+        ], style={
+            'background-color':colors.light_grey,
+            'padding':20
+            }),
+
+        # =================
+        # Plots row
         # =================
+        html.Div([
+
+            # =================
+            # Fist column
+            html.Div([
+                # -> Same packet content
+                dcc.Graph(
+                    id='SamePacket_graph',
+                    figure=load_figure('powerCapture_SamePacket')
+                ),
+            ], className="six columns"),
+            # =================
+
+            # =================
+            # Second column
+            html.Div([
+                # -> Diff packet content
+                dcc.Graph(
+                    id='DiffPacket_graph',
+                    figure=load_figure('powerCapture_DiffPacket')
+                ),
+            ], className="six columns"),
+            # =================
+
+        ], className="row"),
+
+        # Time delta
+        html.H4(
+            'Estimated time delta between transmittions (in ticks)',
+            style={'textAlign': 'center',}
+        ),
+        dcc.Slider(
+            id='time-slider',
+            min=-140,
+            max=140,
+            value=0,
+            marks={str(Delta): str(Delta) for Delta in TimeDeltaValues},
+            step=None,
+            included=False
+        ),
+    ])
 
-    ], className="row"),
-
-    # Time delta
-    html.H4(
-        'Estimated time delta between transmittions (in ticks)',
-        style={'textAlign': 'center',}
-    ),
-    dcc.Slider(
-        id='time-slider',
-        min=-140,
-        max=140,
-        value=0,
-        marks={str(Delta): str(Delta) for Delta in TimeDeltaValues},
-        step=None,
-        included=False
-    ),
-])
 
 @app.callback(
     Output('SamePacket_graph', 'figure'),
@@ -202,17 +223,22 @@ layout = html.Div([
      Input('time-slider', 'value'),],
     [State('transmitter-pair', 'value'),
      State('modes', 'value'),
-     State('enable-options', 'value'),])
-def update_PowerDelta_graph(n_clicks,TimeDelta,TransPair,ModesToShow,Enable):
+     State('enable-options', 'value'),
+     State('confidence-level', 'value'),
+     State('power-binning', 'value'),],
+    prevent_initial_call=True)
+def update_PowerDelta_graph(n_clicks,TimeDelta,TransPair,ModesToShow,Enable,Confidence,PowerBin):
     return prr_f_PowerDelta(
-        df,
+        get_data_cube(),
         TimeDelta,
         1, #SamePayload,
         TransPair,
         ModesToShow,
-        DataPath,
         showMarkers=(ShowMarkers in Enable),
-        showCI=(ShowCI in Enable)
+        showCI=(ShowCI in Enable),
+        confidence=Confidence,
+        powerBin=PowerBin,
+        as_dict=True
         )
 
 @app.callback(
@@ -221,15 +247,20 @@ def update_PowerDelta_graph(n_clicks,TimeDelta,TransPair,ModesToShow,Enable):
      Input('time-slider', 'value'),],
     [State('transmitter-pair', 'value'),
      State('modes', 'value'),
-     State('enable-options', 'value'),])
-def update_PowerDelta_graph(n_clicks,TimeDelta,TransPair,ModesToShow,Enable):
+     State('enable-options', 'value'),
+     State('confidence-level', 'value'),
+     State('power-binning', 'value'),],
+    prevent_initial_call=True)
+def update_PowerDelta_graph(n_clicks,TimeDelta,TransPair,ModesToShow,Enable,Confidence,PowerBin):
     return prr_f_PowerDelta(
-        df,
+        get_data_cube(),
         TimeDelta,
         0, #SamePayload,
         TransPair,
         ModesToShow,
-        DataPath,
         showMarkers=(ShowMarkers in Enable),
-        showCI=(ShowCI in Enable)
+        showCI=(ShowCI in Enable),
+        confidence=Confidence,
+        powerBin=PowerBin,
+        as_dict=True
         )